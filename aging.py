@@ -0,0 +1,63 @@
+from datetime import timedelta
+from sqlalchemy import and_, case, func, literal_column
+from app import db
+from models import Customer, Installment, Invoice
+
+# (key, label, lowest days overdue, highest days overdue)
+AGING_BUCKETS = (
+    ('current', 'غير مستحق', None, 0),
+    ('days_1_30', '1 - 30 يوم', 1, 30),
+    ('days_31_60', '31 - 60 يوم', 31, 60),
+    ('days_61_90', '61 - 90 يوم', 61, 90),
+    ('days_over_90', 'أكثر من 90 يوم', 91, None),
+)
+AGING_FIELDS = tuple(key for key, _, _, _ in AGING_BUCKETS) + ('total',)
+
+# Literal so the predicate matches ix_installments_open on SQLite, which
+# cannot use a partial index against a bound parameter.
+OPEN_INSTALLMENT = Installment.status != literal_column("'paid'")
+
+
+def _bucket_sums(today):
+    remaining = Installment.amount - func.coalesce(Installment.paid_amount, 0)
+    sums = []
+    for key, _, low, high in AGING_BUCKETS:
+        # due_date <= today - low  <=>  at least `low` days overdue
+        conditions = []
+        if low is not None:
+            conditions.append(Installment.due_date <= today - timedelta(days=low))
+        if high is not None:
+            conditions.append(Installment.due_date >= today - timedelta(days=high))
+        sums.append(func.sum(case((and_(*conditions), remaining), else_=0)).label(key))
+    sums.append(func.sum(remaining).label('total'))
+    return sums
+
+
+def aging_by_customer(today, customer_ids=None):
+    query = db.session.query(
+        Invoice.customer_id.label('customer_id'), *_bucket_sums(today)
+    ).select_from(Installment).join(Invoice, Installment.invoice_id == Invoice.id).filter(OPEN_INSTALLMENT)
+    if customer_ids is not None:
+        query = query.filter(Invoice.customer_id.in_(customer_ids))
+    return query.group_by(Invoice.customer_id)
+
+
+def aging_report_query(today, customer_ids=None):
+    # One grouped pass over the open installments. The grand totals ride
+    # along as window sums over the grouped rows, so a page of customers and
+    # the totals row come back from the same statement.
+    grouped = aging_by_customer(today, customer_ids).subquery()
+    bucket_columns = [grouped.c[field] for field in AGING_FIELDS]
+    totals = [func.sum(column).over().label(f'all_{column.key}') for column in bucket_columns]
+    report = db.session.query(grouped, *totals).subquery()
+    return db.session.query(
+        Customer.id, Customer.name, Customer.phone,
+        *[report.c[field] for field in AGING_FIELDS],
+        *[report.c[f'all_{field}'] for field in AGING_FIELDS]
+    ).join(report, report.c.customer_id == Customer.id).filter(report.c.total > 0)
+
+
+def aging_totals(rows):
+    if not rows:
+        return {field: 0 for field in AGING_FIELDS}
+    return {field: getattr(rows[0], f'all_{field}') or 0 for field in AGING_FIELDS}
@@ -0,0 +1,68 @@
+from datetime import timedelta
+from sqlalchemy import case, func
+from app import db
+from models import Product, ProductDailySales
+
+VELOCITY_DAYS = 30
+
+
+def _sales_by_product(start, end):
+    # Reads only the per-product daily rollup. `recent_quantity` covers the
+    # VELOCITY_DAYS ending at `end` regardless of the selected range.
+    s = ProductDailySales
+    velocity_start = end - timedelta(days=VELOCITY_DAYS - 1)
+    in_range = s.day >= start
+    return db.select(
+        s.product_id,
+        func.sum(case((in_range, s.quantity), else_=0)).label('quantity'),
+        func.sum(case((in_range, s.revenue), else_=0)).label('revenue'),
+        func.sum(case((s.day >= velocity_start, s.quantity), else_=0)).label('recent_quantity'),
+    ).where(s.day >= min(start, velocity_start), s.day <= end).group_by(s.product_id).subquery()
+
+
+def _product_rows(sales):
+    return db.select(
+        Product.id, Product.name, Product.barcode, Product.stock_quantity,
+        func.coalesce(sales.c.quantity, 0).label('quantity'),
+        func.coalesce(sales.c.revenue, 0).label('revenue'),
+        func.coalesce(sales.c.recent_quantity, 0).label('recent_quantity'),
+    )
+
+
+def _with_rates(rows):
+    result = []
+    for row in rows:
+        stock = row.stock_quantity or 0
+        daily = row.recent_quantity / VELOCITY_DAYS
+        result.append(dict(
+            row._asdict(),
+            days_of_stock=stock / daily if daily else None,
+            sell_through=row.quantity / (row.quantity + stock) if row.quantity + stock > 0 else None,
+        ))
+    return result
+
+
+def top_products(start, end, by='quantity', limit=20):
+    sales = _sales_by_product(start, end)
+    order = sales.c.revenue if by == 'revenue' else sales.c.quantity
+    stmt = _product_rows(sales).join(sales, sales.c.product_id == Product.id).where(sales.c.quantity > 0).order_by(
+        order.desc(), Product.id
+    ).limit(limit)
+    return _with_rates(db.session.execute(stmt))
+
+
+def slow_movers(start, end, limit=20):
+    # Products with stock on hand that sold least in the range.
+    sales = _sales_by_product(start, end)
+    stmt = _product_rows(sales).outerjoin(sales, sales.c.product_id == Product.id).where(
+        Product.stock_quantity > 0
+    ).order_by(func.coalesce(sales.c.quantity, 0), Product.stock_quantity.desc(), Product.id).limit(limit)
+    return _with_rates(db.session.execute(stmt))
+
+
+def product_sales_totals(start, end):
+    s = ProductDailySales
+    row = db.session.query(
+        func.sum(s.quantity), func.sum(s.revenue), func.count(func.distinct(s.product_id))
+    ).filter(s.day >= start, s.day <= end, s.quantity != 0).one()
+    return [value or 0 for value in row]
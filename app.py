@@ -1,32 +1,92 @@
 import os
 import logging
+import time
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from replica import RoutingSession
 
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+def load_config(app):
+    app.secret_key = os.environ.get("SESSION_SECRET")
+    app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO").upper()
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    if os.environ.get("DATABASE_REPLICA_URL"):
+        app.config["SQLALCHEMY_BINDS"] = {"replica": os.environ["DATABASE_REPLICA_URL"]}
+    app.config["REPLICA_MAX_LAG"] = float(os.environ.get("REPLICA_MAX_LAG", 5))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    if os.environ.get("DB_POOL_SIZE"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"] = int(os.environ["DB_POOL_SIZE"])
+    app.config["CATALOG_CHECK_INTERVAL"] = float(os.environ.get("CATALOG_CHECK_INTERVAL", 2))
+    app.config["SLOW_REQUEST_MS"] = float(os.environ.get("SLOW_REQUEST_MS", 500))
+    app.config["OVERDUE_SWEEP_INTERVAL"] = int(os.environ.get("OVERDUE_SWEEP_INTERVAL", 0))
+    app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS", 730))
+    app.config["REPORT_CACHE_BACKEND"] = os.environ.get("REPORT_CACHE_BACKEND", "memory")
+    app.config["REPORT_CACHE_DIR"] = os.environ.get("REPORT_CACHE_DIR")
+    app.config["REPORT_CACHE_SIZE"] = int(os.environ.get("REPORT_CACHE_SIZE", 256))
 
-db.init_app(app)
 
-with app.app_context():
+def configure_logging(level):
+    logging.basicConfig(level=level, format="%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s")
+    logging.getLogger().setLevel(level)
+
+
+def create_app(config=None):
+    # Builds the app without touching the database, so it is safe to call in
+    # a gunicorn master with --preload. Schema changes are `flask migrate`.
+    started = time.perf_counter()
+    timings = {}
+
+    def mark(phase, since):
+        timings[phase] = (time.perf_counter() - since) * 1000
+        return time.perf_counter()
+
+    step = started
+    app = Flask(__name__)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+    load_config(app)
+    if config:
+        app.config.update(config)
+    configure_logging(app.config["LOG_LEVEL"])
+    step = mark("config", step)
+
+    db.init_app(app)
     import models  # noqa: F401
-    db.create_all()
+    import search  # noqa: F401
+    step = mark("models", step)
+
+    from routes import bp as routes_bp
+    from commands import bp as commands_bp
+    app.register_blueprint(routes_bp)
+    app.register_blueprint(commands_bp)
+    step = mark("routes", step)
+
+    from http_cache import init_http_cache
+    from instrumentation import init_instrumentation
+    from overdue import init_overdue_sweeper
+    from replica import init_replica
+    init_http_cache(app)
+    init_instrumentation(app)
+    init_replica(app)
+    init_overdue_sweeper(app)
+    mark("extensions", step)
+
+    timings["total"] = (time.perf_counter() - started) * 1000
+    app.extensions["startup_timings"] = timings
+    logger.info("app ready in %.1fms (%s)", timings["total"],
+                " ".join(f"{phase}={ms:.1f}ms" for phase, ms in timings.items() if phase != "total"))
+    return app
@@ -0,0 +1,103 @@
+from datetime import date, datetime, timedelta
+from app import db
+from models import (
+    AppSetting, Installment, Invoice, InvoiceItem, Payment,
+    installments_archive, invoice_items_archive, invoices_archive, payments_archive
+)
+
+CUTOFF_KEY = 'archive_cutoff'
+ARCHIVE_BATCH = 500
+
+# Live table -> archive table, parents first.
+ARCHIVE_TABLES = (
+    (Invoice.__table__, invoices_archive),
+    (InvoiceItem.__table__, invoice_items_archive),
+    (Installment.__table__, installments_archive),
+    (Payment.__table__, payments_archive),
+)
+
+
+def archive_cutoff():
+    # Everything archived so far was created before this date; ranges that
+    # start on or after it never need the archive tables.
+    value = AppSetting.get_value(CUTOFF_KEY)
+    return date.fromisoformat(value) if value else None
+
+
+def needs_archive(start=None):
+    cutoff = archive_cutoff()
+    return cutoff is not None and (start is None or start < cutoff)
+
+
+def _with_archive(live, archive, start=None):
+    if not needs_archive(start):
+        return live
+    return db.union_all(db.select(live), db.select(archive)).subquery(f'{live.name}_all')
+
+
+def invoice_history(start=None):
+    return _with_archive(Invoice.__table__, invoices_archive, start)
+
+
+def invoice_item_history(start=None):
+    return _with_archive(InvoiceItem.__table__, invoice_items_archive, start)
+
+
+def customer_invoices(customer_id):
+    columns = ('id', 'invoice_number', 'total_amount', 'paid_amount', 'payment_method',
+               'num_installments', 'status', 'created_at')
+    live = Invoice.__table__
+    stmt = db.select(*[live.c[name] for name in columns], db.literal(False).label('archived')).where(
+        live.c.customer_id == customer_id
+    )
+    if needs_archive():
+        stmt = db.union_all(stmt, db.select(
+            *[invoices_archive.c[name] for name in columns], db.literal(True).label('archived')
+        ).where(invoices_archive.c.customer_id == customer_id))
+    history = stmt.subquery()
+    return db.session.execute(
+        db.select(history).order_by(history.c.created_at.desc(), history.c.id.desc())
+    ).all()
+
+
+def has_archived_invoices(customer_id):
+    return db.session.query(
+        db.select(invoices_archive.c.id).where(invoices_archive.c.customer_id == customer_id).exists()
+    ).scalar()
+
+
+def _conditions(invoice_ids):
+    installment_ids = db.select(Installment.id).where(Installment.invoice_id.in_(invoice_ids))
+    return {
+        Invoice.__table__: Invoice.id.in_(invoice_ids),
+        InvoiceItem.__table__: InvoiceItem.invoice_id.in_(invoice_ids),
+        Installment.__table__: Installment.invoice_id.in_(invoice_ids),
+        Payment.__table__: Payment.installment_id.in_(installment_ids),
+    }
+
+
+def archive_invoices(days, batch_size=ARCHIVE_BATCH, today=None):
+    # Moves fully paid invoices older than `days`, with their items,
+    # installments and payments, one committed batch at a time. Daily
+    # rollups and customer balances are unaffected, so nothing else moves.
+    cutoff = (today or date.today()) - timedelta(days=days)
+    before = datetime.combine(cutoff, datetime.min.time())
+    moved = 0
+    while True:
+        invoice_ids = [row[0] for row in db.session.query(Invoice.id).filter(
+            Invoice.status == 'paid', Invoice.created_at < before
+        ).order_by(Invoice.id).limit(batch_size)]
+        if not invoice_ids:
+            break
+        conditions = _conditions(invoice_ids)
+        for live, archive in ARCHIVE_TABLES:
+            names = [column.name for column in live.columns]
+            db.session.execute(archive.insert().from_select(names, db.select(live).where(conditions[live])))
+        for live, _ in reversed(ARCHIVE_TABLES):
+            db.session.execute(live.delete().where(conditions[live]))
+        previous = archive_cutoff()
+        if previous is None or previous < cutoff:
+            AppSetting.set_value(CUTOFF_KEY, cutoff.isoformat())
+        db.session.commit()
+        moved += len(invoice_ids)
+    return moved
@@ -0,0 +1,113 @@
+import contextvars
+import json
+import random
+import statistics
+import time
+from flask import current_app
+from app import db
+from instrumentation import count_queries
+from models import Customer, Product
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def isolated_request(client, *args, **kwargs):
+    # The test client reuses an app context that is already pushed (the CLI
+    # command's), carrying `g` and the scoped session from one request into
+    # the next. An empty context makes each request push and tear down its
+    # own, as it would in production.
+    return contextvars.Context().run(client.open, *args, **kwargs)
+
+
+def _scenarios(rng):
+    customer_ids = [row[0] for row in db.session.query(Customer.id).limit(1000)]
+    products = db.session.query(Product.id, Product.barcode, Product.name, Product.price).filter(
+        Product.stock_quantity > 10
+    ).limit(1000).all()
+    if not customer_ids or not products:
+        raise RuntimeError('benchmark needs customers and in-stock products, run generate-data first')
+
+    def search():
+        product = rng.choice(products)
+        term = product.barcode if rng.random() < 0.5 else product.name.split()[0]
+        return 'GET', f'/products/search?q={term}', None
+
+    def checkout():
+        product = rng.choice(products)
+        return 'POST', '/sales/new', {
+            'customer_id': str(rng.choice(customer_ids)),
+            'payment_method': 'cash',
+            'product_id[]': [str(product.id)],
+            'quantity[]': ['1'],
+            'price[]': [str(product.price)],
+        }
+
+    return {
+        'dashboard': lambda: ('GET', '/', None),
+        'customers_list': lambda: ('GET', '/customers', None),
+        'sales_list': lambda: ('GET', '/sales', None),
+        'installments_list': lambda: ('GET', '/installments', None),
+        'reports': lambda: ('GET', '/reports', None),
+        'aging_report': lambda: ('GET', '/reports/aging', None),
+        'product_analytics': lambda: ('GET', '/reports/products', None),
+        'product_search': search,
+        'sale_new': checkout,
+    }
+
+
+def run_benchmark(iterations=20, seed=0):
+    rng = random.Random(seed)
+    client = current_app.test_client()
+    results = {}
+    for name, scenario in _scenarios(rng).items():
+        method, path, data = scenario()
+        isolated_request(client, path, method=method, data=data)  # warm-up
+        timings, queries = [], []
+        for _ in range(iterations):
+            method, path, data = scenario()
+            with count_queries() as counter:
+                started = time.perf_counter()
+                response = isolated_request(client, path, method=method, data=data)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(counter['count'])
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: {method} {path} returned HTTP {response.status_code}')
+        results[name] = {
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'queries': max(queries),
+        }
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25, min_delta_ms=5.0):
+    # Small absolute differences are timer noise on sub-10ms routes.
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        slower = current['p95_ms'] - previous['p95_ms']
+        if slower > min_delta_ms and current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {previous["p95_ms"]}ms -> {current["p95_ms"]}ms')
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: queries {previous["queries"]} -> {current["queries"]}')
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
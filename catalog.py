@@ -0,0 +1,136 @@
+import bisect
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from app import db
+from models import AppSetting, Product
+from search import normalize_search_text
+from sqlcompat import dialect_insert
+
+VERSION_KEY = 'catalog_version'
+STRUCTURE_KEY = 'catalog_structure_version'
+# Tolerates clock skew between app servers stamping Product.updated_at.
+SYNC_MARGIN = timedelta(seconds=30)
+
+
+def product_dict(product_id, barcode, name, price, stock):
+    return {
+        'id': product_id,
+        'barcode': barcode,
+        'name': name,
+        'price': float(price),
+        'stock': stock
+    }
+
+
+class _Snapshot:
+    def __init__(self, version, structure, synced_at, rows):
+        self.version = version
+        self.structure = structure
+        self.synced_at = synced_at
+        self.products = {}
+        self.by_barcode = {}
+        tokens = []
+        for product_id, barcode, name, price, stock in rows:
+            self.products[product_id] = product_dict(product_id, barcode, name, price, stock)
+            if barcode:
+                self.by_barcode[barcode] = product_id
+                tokens.append((barcode.lower(), product_id))
+            normalized = normalize_search_text(name)
+            tokens.append((normalized, product_id))
+            tokens.extend((word, product_id) for word in normalized.split()[1:])
+        tokens.sort()
+        self.tokens = [token for token, _ in tokens]
+        self.token_ids = [product_id for _, product_id in tokens]
+
+
+# Process-local copy of the product table for the POS scan path. Writers
+# bump a version stamp in app_settings; each worker compares it with its
+# snapshot at most once every CATALOG_CHECK_INTERVAL seconds.
+class ProductCatalog:
+
+    def __init__(self):
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    def _fresh_snapshot(self):
+        snapshot = self._snapshot
+        interval = current_app.config.get('CATALOG_CHECK_INTERVAL', 2)
+        if snapshot is not None and time.monotonic() - self._checked_at < interval:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            stamps = dict(db.session.query(AppSetting.key, AppSetting.value).filter(
+                AppSetting.key.in_((VERSION_KEY, STRUCTURE_KEY))
+            ).all())
+            version = stamps.get(VERSION_KEY, '')
+            structure = stamps.get(STRUCTURE_KEY, '')
+            columns = (Product.id, Product.barcode, Product.name, Product.price, Product.stock_quantity)
+            synced_at = datetime.utcnow()
+            if snapshot is None or snapshot.structure != structure:
+                rows = db.session.query(*columns).all()
+                snapshot = self._snapshot = _Snapshot(version, structure, synced_at, rows)
+            elif snapshot.version != version:
+                # Only stock moved: patch the rows touched since the last sync
+                # instead of re-tokenizing the whole catalog.
+                changed = db.session.query(*columns).filter(
+                    Product.updated_at >= snapshot.synced_at - SYNC_MARGIN
+                ).all()
+                for row in changed:
+                    snapshot.products[row[0]] = product_dict(*row)
+                snapshot.version = version
+                snapshot.synced_at = synced_at
+            self._checked_at = time.monotonic()
+        return snapshot
+
+    @property
+    def version(self):
+        return self._fresh_snapshot().version or 'initial'
+
+    def search(self, query, limit=10):
+        snapshot = self._fresh_snapshot()
+        query = query.strip()
+        results = []
+        seen = set()
+        exact = snapshot.by_barcode.get(query)
+        if exact is not None:
+            results.append(snapshot.products[exact])
+            seen.add(exact)
+        prefix = normalize_search_text(query)
+        if not prefix:
+            return results
+        i = bisect.bisect_left(snapshot.tokens, prefix)
+        while i < len(snapshot.tokens) and len(results) < limit:
+            if not snapshot.tokens[i].startswith(prefix):
+                break
+            product_id = snapshot.token_ids[i]
+            if product_id not in seen:
+                seen.add(product_id)
+                results.append(snapshot.products[product_id])
+            i += 1
+        return results
+
+
+catalog = ProductCatalog()
+
+
+def bump_catalog_version(structure=True):
+    # Called after the catalog change is committed, in a transaction of its
+    # own, so checkouts never queue on the version row. Pass structure=False
+    # when only stock quantities changed.
+    keys = (VERSION_KEY, STRUCTURE_KEY) if structure else (VERSION_KEY,)
+    for key in keys:
+        stmt = dialect_insert(AppSetting).values(key=key, value=uuid.uuid4().hex)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[AppSetting.key],
+            set_={'value': stmt.excluded.value}
+        )
+        db.session.execute(stmt)
+    db.session.commit()
+    catalog.invalidate()
@@ -0,0 +1,221 @@
+import click
+from flask import Blueprint, current_app
+from app import db
+from archive import archive_invoices
+from benchmark import compare_to_baseline, isolated_request, load_baseline, run_benchmark, save_baseline
+from datagen import generate_data
+from debts import find_debt_mismatches, rebuild_customer_debts
+from imports import import_customers, import_products, open_csv
+from instrumentation import count_queries
+from loadtest import DEFAULT_MIX, check_invariants, prepare_run, run_load_test
+from inventory import take_stock_snapshot
+from migrations import migrate_schema
+from models import Customer, Installment, Invoice
+from overdue import sweep_overdue
+from replica import sync_sqlite_replica
+from rollups import rebuild_daily_sales, rebuild_product_sales
+from search import rebuild_search_index
+
+# cli_group=None keeps the commands at the top level: `flask --app main check-debts`.
+bp = Blueprint('commands', __name__, cli_group=None)
+
+
+@bp.cli.command('migrate')
+def migrate_command():
+    actions = migrate_schema()
+    for action in actions:
+        click.echo(action)
+    click.echo(f'schema up to date ({len(actions)} change(s))')
+
+
+@bp.cli.command('check-debts')
+@click.option('--fix', is_flag=True, help='Rebuild every customer balance from invoices.')
+def check_debts(fix):
+    mismatches = find_debt_mismatches()
+    for customer_id, name, stored, expected in mismatches:
+        click.echo(f'customer {customer_id} ({name}): stored={stored} expected={expected}')
+    click.echo(f'{len(mismatches)} mismatched customer balance(s)')
+    if fix:
+        count = rebuild_customer_debts()
+        click.echo(f'rebuilt {count} customer balance(s)')
+
+
+@bp.cli.command('sweep-overdue')
+def sweep_overdue_command():
+    count = sweep_overdue()
+    click.echo(f'marked {count} installment(s) overdue')
+
+
+@bp.cli.command('rebuild-daily-sales')
+def rebuild_daily_sales_command():
+    count = rebuild_daily_sales()
+    click.echo(f'rebuilt {count} daily sales row(s)')
+
+
+@bp.cli.command('rebuild-product-sales')
+def rebuild_product_sales_command():
+    count = rebuild_product_sales()
+    click.echo(f'rebuilt {count} product sales row(s)')
+
+
+@bp.cli.command('archive-invoices')
+@click.option('--days', type=int, default=None, help='Archive paid invoices older than this (default ARCHIVE_AFTER_DAYS).')
+def archive_invoices_command(days):
+    days = days if days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    count = archive_invoices(days)
+    click.echo(f'archived {count} paid invoice(s) older than {days} days')
+
+
+@bp.cli.command('snapshot-stock')
+def snapshot_stock_command():
+    taken_at = take_stock_snapshot()
+    click.echo(f'stock snapshot taken at {taken_at:%Y-%m-%d %H:%M:%S}')
+
+
+@bp.cli.command('sync-replica')
+def sync_replica_command():
+    try:
+        sync_sqlite_replica()
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    click.echo('replica copied from primary')
+
+
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    count = rebuild_search_index()
+    click.echo(f'reindexed {count} customer/product row(s)')
+
+
+# Upper bound on SQL statements per page, independent of how many rows
+# the page shows. Each page is requested in a fresh app context, so cached
+# paths are counted the way a real request runs them.
+QUERY_BUDGETS = {
+    '/': 8,
+    '/customers': 2,
+    '/products': 3,
+    '/sales': 2,
+    '/installments': 3,
+    '/reports': 6,
+    '/reports/aging': 1,
+    '/reports/products': 4,
+    '/sales/new': 2,
+    '/sales/{invoice_id}': 4,
+    '/customers/{customer_id}': 4,
+    '/installments/{installment_id}/pay': 2,
+}
+
+
+@bp.cli.command('check-query-counts')
+def check_query_counts():
+    ids = {
+        'invoice_id': db.session.query(db.func.max(Invoice.id)).scalar(),
+        'customer_id': db.session.query(db.func.max(Customer.id)).scalar(),
+        'installment_id': db.session.query(db.func.max(Installment.id)).scalar(),
+    }
+    client = current_app.test_client()
+    failures = 0
+    for template, budget in QUERY_BUDGETS.items():
+        path = template.format(**ids)
+        if 'None' in path:
+            click.echo(f'{template}: skipped, no rows')
+            continue
+        with count_queries() as counter:
+            response = isolated_request(client, path)
+        ok = response.status_code == 200 and counter['count'] <= budget
+        failures += not ok
+        click.echo(f'{path}: {counter["count"]}/{budget} queries, HTTP {response.status_code}'
+                   f'{"" if ok else "  FAIL"}')
+    if failures:
+        raise click.ClickException(f'{failures} page(s) over their query budget')
+
+
+@bp.cli.command('generate-data')
+@click.option('--customers', default=1000, show_default=True)
+@click.option('--products', default=2000, show_default=True)
+@click.option('--invoices', default=20000, show_default=True)
+@click.option('--days', default=730, show_default=True, help='Spread invoices over this many past days.')
+@click.option('--seed', type=int, default=None)
+def generate_data_command(customers, products, invoices, days, seed):
+    customer_count, product_count, invoice_count = generate_data(customers, products, invoices, days, seed)
+    click.echo(f'generated {invoice_count} invoice(s) across {customer_count} customer(s) '
+               f'and {product_count} product(s)')
+
+
+@bp.cli.command('benchmark')
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--baseline', 'baseline_path', default='bench_baseline.json', show_default=True)
+@click.option('--save', is_flag=True, help='Store this run as the new baseline.')
+@click.option('--tolerance', default=0.25, show_default=True, help='Allowed p95 slowdown before failing.')
+def benchmark_command(iterations, baseline_path, save, tolerance):
+    results = run_benchmark(iterations)
+    baseline = load_baseline(baseline_path) or {}
+    click.echo(f'{"route":<20}{"p50 ms":>10}{"p95 ms":>10}{"queries":>9}{"base p95":>10}')
+    for name, row in results.items():
+        base = baseline.get(name, {}).get('p95_ms', '-')
+        click.echo(f'{name:<20}{row["p50_ms"]:>10}{row["p95_ms"]:>10}{row["queries"]:>9}{base:>10}')
+    if save:
+        save_baseline(baseline_path, results)
+        click.echo(f'baseline written to {baseline_path}')
+        return
+    regressions = compare_to_baseline(results, baseline, tolerance)
+    for line in regressions:
+        click.echo(f'REGRESSION {line}')
+    if regressions:
+        raise click.ClickException(f'{len(regressions)} regression(s) against {baseline_path}')
+
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in DEFAULT_MIX or not weight.strip().isdigit():
+            raise click.BadParameter(f'expected e.g. sale=6,pay=3,delete=1, got {part!r}')
+        mix[kind.strip()] = int(weight)
+    return mix
+
+
+@bp.cli.command('load-test')
+@click.option('--tills', default=20, show_default=True, help='Concurrent tills (threads).')
+@click.option('--duration', default=10.0, show_default=True, help='Seconds to run.')
+@click.option('--rate', default=0.0, show_default=True, help='Operations per second per till (0 = as fast as possible).')
+@click.option('--mix', default='sale=6,pay=3,delete=1', show_default=True)
+@click.option('--hot-products', default=5, show_default=True, help='Number of SKUs every till sells.')
+@click.option('--seed', default=0, show_default=True)
+def load_test_command(tills, duration, rate, mix, hot_products, seed):
+    # Writes real sales, payments and deletions: use a throwaway database.
+    pool = db.engine.pool
+    if hasattr(pool, 'size') and pool.size() + max(pool._max_overflow, 0) < tills:
+        click.echo(f'warning: connection pool ({pool.size()} + {pool._max_overflow}) is smaller than '
+                   f'{tills} tills, set DB_POOL_SIZE to avoid measuring pool waits')
+    try:
+        run = prepare_run(hot_products, seed)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    results = run_load_test(current_app._get_current_object(), run, tills, duration, rate or None,
+                            _parse_mix(mix))
+    click.echo(f'{tills} till(s) for {run.elapsed:.1f}s on {db.engine.dialect.name}, marker {run.marker}')
+    click.echo(f'{"operation":<10}{"count":>8}{"ops/s":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}  outcomes')
+    for kind, row in results.items():
+        outcomes = ' '.join(f'{name}={count}' for name, count in sorted(row['outcomes'].items()))
+        click.echo(f'{kind:<10}{row["count"]:>8}{row["per_second"]:>8}{row["p50_ms"]:>9}{row["p95_ms"]:>9}'
+                   f'{row["p99_ms"]:>9}{row["max_ms"]:>9}  {outcomes}')
+    violations = check_invariants(run)
+    for line in violations:
+        click.echo(f'VIOLATION {line}')
+    if violations:
+        raise click.ClickException(f'{len(violations)} invariant violation(s)')
+    click.echo('invariants hold: unique invoice numbers, stock = initial - net sold, paid = sum of payments')
+
+
+@bp.cli.command('import-csv')
+@click.argument('kind', type=click.Choice(['products', 'customers']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', default=1000, show_default=True)
+def import_csv_command(kind, path, chunk_size):
+    importer = import_products if kind == 'products' else import_customers
+    with open(path, 'rb') as f:
+        result = importer(open_csv(f), chunk_size=chunk_size)
+    for line, message in result.errors:
+        click.echo(f'line {line}: {message}')
+    click.echo(f'imported {result.imported} row(s), {result.failed} row(s) with errors')
@@ -0,0 +1,206 @@
+import random
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from app import db
+from catalog import bump_catalog_version
+from debts import rebuild_customer_debts
+from models import Customer, Installment, Invoice, InvoiceCounter, InvoiceItem, Payment, Product
+from rollups import rebuild_daily_sales, rebuild_product_sales
+from search import normalize_search_text
+from sqlcompat import dialect_insert
+
+FIRST_NAMES = ['أحمد', 'محمد', 'فاطمة', 'سارة', 'خالد', 'عبدالله', 'نورة', 'مريم', 'يوسف', 'عمر',
+               'ليلى', 'هند', 'إبراهيم', 'علي', 'حسن', 'ريم', 'منى', 'سلمان', 'فيصل', 'جميلة']
+LAST_NAMES = ['العمري', 'القحطاني', 'الزهراني', 'الغامدي', 'الشهري', 'الدوسري', 'المطيري', 'العتيبي',
+              'الحربي', 'السبيعي', 'الشمري', 'التميمي', 'البلوي', 'الجهني', 'العنزي']
+CITIES = ['الرياض', 'جدة', 'الدمام', 'مكة', 'المدينة', 'الخبر', 'أبها', 'تبوك']
+PRODUCT_KINDS = ['لابتوب', 'شاشة', 'لوحة مفاتيح', 'ماوس', 'طابعة', 'سماعات', 'هارد ديسك', 'فلاش ميموري',
+                 'كابل', 'حقيبة', 'راوتر', 'كاميرا', 'جوال', 'شاحن', 'ساعة ذكية']
+BRANDS = ['HP', 'Dell', 'Lenovo', 'Samsung', 'Apple', 'Asus', 'Sony', 'Xiaomi', 'Huawei', 'Canon']
+INSTALLMENT_COUNTS = (3, 6, 12)
+BATCH_SIZE = 1000
+
+
+def _skewed_choice(rng, ids, power=2.0):
+    # A few regulars/best sellers account for most of the activity.
+    return ids[int(len(ids) * rng.random() ** power)]
+
+
+def _insert_returning_ids(model, rows):
+    if not rows:
+        return []
+    return list(db.session.scalars(
+        db.insert(model).returning(model.id, sort_by_parameter_order=True), rows
+    ))
+
+
+def generate_customers(rng, count):
+    ids = []
+    now = datetime.utcnow()
+    for start in range(0, count, BATCH_SIZE):
+        rows = []
+        for _ in range(min(BATCH_SIZE, count - start)):
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+            phone = f'05{rng.randrange(10 ** 8):08d}'
+            rows.append({
+                'name': name,
+                'phone': phone,
+                'address': f'{rng.choice(CITIES)}، حي {rng.randint(1, 60)}',
+                'search_text': normalize_search_text(f'{name} {phone}'),
+                'created_at': now,
+                'updated_at': now,
+            })
+        ids.extend(_insert_returning_ids(Customer, rows))
+        db.session.commit()
+    return ids
+
+
+def generate_products(rng, count):
+    products = []
+    now = datetime.utcnow()
+    # Continue after the highest generated barcode; counting rows would hand
+    # out numbers again once any product has been deleted.
+    last = db.session.query(db.func.max(Product.barcode)).filter(
+        Product.barcode.like('629%'), db.func.length(Product.barcode) == 13
+    ).scalar()
+    offset = int(last[3:]) + 1 if last and last[3:].isdigit() else 0
+    for start in range(0, count, BATCH_SIZE):
+        rows = []
+        for i in range(start, min(start + BATCH_SIZE, count)):
+            name = f'{rng.choice(PRODUCT_KINDS)} {rng.choice(BRANDS)} {rng.randint(100, 9999)}'
+            barcode = f'629{offset + i:010d}'
+            price = Decimal(str(round(min(rng.lognormvariate(5.0, 1.1), 20000), 2)))
+            rows.append({
+                'barcode': barcode,
+                'name': name,
+                'price': price,
+                'stock_quantity': rng.choice([0, rng.randint(1, 5)]) if rng.random() < 0.1 else rng.randint(6, 300),
+                'min_stock_level': rng.choice([3, 5, 10]),
+                'search_text': normalize_search_text(f'{name} {barcode}'),
+                'created_at': now,
+                'updated_at': now,
+            })
+        ids = _insert_returning_ids(Product, rows)
+        products.extend((product_id, row['price']) for product_id, row in zip(ids, rows))
+        db.session.commit()
+    return products
+
+
+def _installment_rows(rng, total, count, created_at, today):
+    amount = (total / count).quantize(Decimal('0.01'))
+    rows = []
+    for i in range(count):
+        due_date = created_at.date() + timedelta(days=30 * (i + 1))
+        paid = Decimal('0')
+        if due_date < today:
+            roll = rng.random()
+            if roll < 0.75:
+                paid = amount
+            elif roll < 0.85:
+                paid = (amount * Decimal(str(round(rng.uniform(0.2, 0.8), 2)))).quantize(Decimal('0.01'))
+        if paid >= amount:
+            status = 'paid'
+        elif paid > 0:
+            status = 'partial'
+        elif due_date < today:
+            status = 'overdue'
+        else:
+            status = 'pending'
+        rows.append({
+            'installment_number': i + 1,
+            'amount': amount,
+            'paid_amount': paid,
+            'due_date': due_date,
+            'status': status,
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+    return rows
+
+
+def generate_invoices(rng, count, customer_ids, products, days):
+    today = date.today()
+    counters = {c.prefix: c.last_number for c in InvoiceCounter.query.all()}
+    generated = 0
+    for start in range(0, count, BATCH_SIZE):
+        invoices, items, installments = [], [], []
+        for _ in range(min(BATCH_SIZE, count - start)):
+            age = int(days * rng.random() ** 1.5)
+            created_at = datetime.combine(today - timedelta(days=age), time(rng.randint(8, 21), rng.randint(0, 59)))
+            prefix = created_at.strftime('%Y%m%d')
+            counters[prefix] = counters.get(prefix, 0) + 1
+
+            lines = []
+            for _ in range(min(1 + int(rng.expovariate(0.8)), 8)):
+                product_id, price = _skewed_choice(rng, products, 1.6)
+                qty = 1 if rng.random() < 0.8 else rng.randint(2, 3)
+                lines.append({'product_id': product_id, 'quantity': qty,
+                              'unit_price': price, 'total_price': price * qty})
+            total = sum((line['total_price'] for line in lines), Decimal('0'))
+
+            if rng.random() < 0.6:
+                method, num, plan = 'cash', 1, []
+                paid = total
+            else:
+                method = 'installment'
+                num = rng.choice(INSTALLMENT_COUNTS)
+                plan = _installment_rows(rng, total, num, created_at, today)
+                paid = sum((row['paid_amount'] for row in plan), Decimal('0'))
+            status = 'paid' if paid >= total else ('partial' if paid > 0 else 'pending')
+
+            invoices.append({
+                'invoice_number': f'{prefix}{counters[prefix]:04d}',
+                'customer_id': _skewed_choice(rng, customer_ids),
+                'total_amount': total,
+                'paid_amount': paid,
+                'payment_method': method,
+                'num_installments': num,
+                'status': status,
+                'created_at': created_at,
+                'updated_at': created_at,
+            })
+            items.append(lines)
+            installments.append(plan)
+
+        invoice_ids = _insert_returning_ids(Invoice, invoices)
+        item_rows, plan_rows = [], []
+        for invoice_id, lines, plan in zip(invoice_ids, items, installments):
+            item_rows.extend(dict(line, invoice_id=invoice_id) for line in lines)
+            plan_rows.extend(dict(row, invoice_id=invoice_id) for row in plan)
+        db.session.execute(db.insert(InvoiceItem), item_rows)
+        installment_ids = _insert_returning_ids(Installment, plan_rows)
+        payments = [{
+            'installment_id': installment_id,
+            'amount': row['paid_amount'],
+            'payment_date': datetime.combine(row['due_date'], time(12)) - timedelta(days=rng.randint(0, 5)),
+        } for installment_id, row in zip(installment_ids, plan_rows) if row['paid_amount'] > 0]
+        if payments:
+            db.session.execute(db.insert(Payment), payments)
+        db.session.commit()
+        generated += len(invoice_ids)
+
+    for prefix, last_number in counters.items():
+        stmt = dialect_insert(InvoiceCounter).values(prefix=prefix, last_number=last_number)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[InvoiceCounter.prefix], set_={'last_number': stmt.excluded.last_number}
+        ))
+    db.session.commit()
+    return generated
+
+
+def generate_data(customers, products, invoices, days=730, seed=None):
+    rng = random.Random(seed)
+    customer_ids = generate_customers(rng, customers)
+    product_rows = generate_products(rng, products)
+    if not customer_ids:
+        customer_ids = [row[0] for row in db.session.query(Customer.id).all()]
+    if not product_rows:
+        product_rows = [tuple(row) for row in db.session.query(Product.id, Product.price).all()]
+    generated = 0
+    if customer_ids and product_rows and invoices:
+        generated = generate_invoices(rng, invoices, customer_ids, product_rows, days)
+    rebuild_customer_debts()
+    rebuild_daily_sales()
+    rebuild_product_sales()
+    bump_catalog_version()
+    return len(customer_ids), len(product_rows), generated
@@ -0,0 +1,67 @@
+from decimal import Decimal
+from sqlalchemy import bindparam, func
+from app import db
+from archive import needs_archive
+from models import Customer, Invoice, invoices_archive
+from report_cache import invalidate_reports
+
+CENT = Decimal('0.01')
+
+
+def adjust_customer_debt(customer_id, delta):
+    if not delta:
+        return
+    db.session.execute(
+        db.update(Customer)
+        .where(Customer.id == customer_id)
+        .values(outstanding_balance=Customer.outstanding_balance + delta)
+    )
+
+
+def adjust_customer_debts(deltas):
+    # One executemany for a batch of customers, in id order like reserve_stock.
+    params = [{'customer_id': customer_id, 'delta': delta}
+              for customer_id, delta in sorted(deltas.items()) if delta]
+    if not params:
+        return
+    table = Customer.__table__
+    db.session.connection().execute(
+        table.update()
+        .where(table.c.id == bindparam('customer_id'))
+        .values(outstanding_balance=table.c.outstanding_balance + bindparam('delta')),
+        params
+    )
+
+
+def _invoice_debt_subquery():
+    debt = db.select(
+        func.coalesce(func.sum(Invoice.total_amount - Invoice.paid_amount), 0)
+    ).where(Invoice.customer_id == Customer.id).scalar_subquery()
+    if needs_archive():
+        # Archived invoices are paid, but rounding can leave them a cent over.
+        archived = invoices_archive.c
+        debt = debt + db.select(
+            func.coalesce(func.sum(archived.total_amount - archived.paid_amount), 0)
+        ).where(archived.customer_id == Customer.id).scalar_subquery()
+    return debt
+
+
+def find_debt_mismatches():
+    expected = _invoice_debt_subquery()
+    return db.session.execute(
+        db.select(Customer.id, Customer.name, Customer.outstanding_balance, expected.label('expected'))
+        # SQLite keeps numerics as floats, so equal balances can differ in
+        # the last bits; only a cent or more is a real mismatch.
+        .where(func.abs(Customer.outstanding_balance - expected) >= CENT)
+        .order_by(Customer.id)
+    ).all()
+
+
+def rebuild_customer_debts():
+    result = db.session.execute(
+        db.update(Customer).values(outstanding_balance=_invoice_debt_subquery()),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    invalidate_reports()
+    return result.rowcount
@@ -0,0 +1,147 @@
+import csv
+import io
+from datetime import date, datetime, timedelta
+from flask import Response, stream_with_context
+from app import db
+from archive import invoice_history, invoice_item_history
+from aging import AGING_BUCKETS, AGING_FIELDS, aging_by_customer
+from inventory import stock_at
+from models import Customer, DailySalesSummary, Installment, Invoice, Payment, Product
+
+YIELD_PER = 1000
+FLUSH_ROWS = 500
+
+STATUS_LABELS = {
+    'pending': 'قيد الانتظار',
+    'partial': 'جزئي',
+    'paid': 'مدفوع',
+    'overdue': 'متأخر',
+}
+METHOD_LABELS = {
+    'cash': 'نقدي',
+    'installment': 'تقسيط',
+}
+
+
+def _csv_chunks(header, rows):
+    # UTF-8 BOM so Excel opens Arabic text correctly.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= FLUSH_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def csv_response(filename, header, rows):
+    response = Response(stream_with_context(_csv_chunks(header, rows)), mimetype='text/csv; charset=utf-8')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _stream(stmt):
+    # yield_per turns on server-side cursors where the driver supports them,
+    # so only one batch of rows is held in memory at a time.
+    return db.session.execute(stmt.execution_options(yield_per=YIELD_PER))
+
+
+def _format_date(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value or ''
+
+
+def invoice_rows(start, end):
+    invoices = invoice_history(start)
+    items = invoice_item_history(start)
+    stmt = db.select(
+        invoices.c.invoice_number, invoices.c.created_at, Customer.name, invoices.c.payment_method,
+        invoices.c.status, invoices.c.total_amount, invoices.c.paid_amount,
+        Product.barcode, Product.name, items.c.quantity, items.c.unit_price, items.c.total_price
+    ).join(Customer, invoices.c.customer_id == Customer.id).join(
+        items, items.c.invoice_id == invoices.c.id
+    ).outerjoin(Product, items.c.product_id == Product.id).where(
+        invoices.c.created_at >= start, invoices.c.created_at < end + timedelta(days=1)
+    ).order_by(invoices.c.created_at, invoices.c.id, items.c.id)
+    for (number, created_at, customer, method, status, total, paid,
+         barcode, product, quantity, unit_price, line_total) in _stream(stmt):
+        yield (number, _format_date(created_at), customer, METHOD_LABELS.get(method, method),
+               STATUS_LABELS.get(status, status), total, paid, barcode or '', product or '',
+               quantity, unit_price, line_total)
+
+
+INVOICE_HEADER = ('رقم الفاتورة', 'التاريخ', 'العميل', 'طريقة الدفع', 'الحالة', 'إجمالي الفاتورة',
+                  'المدفوع', 'الباركود', 'المنتج', 'الكمية', 'سعر الوحدة', 'إجمالي السطر')
+
+
+def installment_rows(filters):
+    stmt = db.select(
+        Invoice.invoice_number, Customer.name, Installment.installment_number, Installment.due_date,
+        Installment.amount, Installment.paid_amount, Installment.status,
+        Payment.payment_date, Payment.amount, Payment.notes
+    ).join(Invoice, Installment.invoice_id == Invoice.id).join(
+        Customer, Invoice.customer_id == Customer.id
+    ).outerjoin(Payment, Payment.installment_id == Installment.id).where(*filters).order_by(
+        Installment.due_date, Installment.id, Payment.payment_date
+    )
+    for (number, customer, inst_number, due_date, amount, paid, status,
+         payment_date, payment_amount, notes) in _stream(stmt):
+        if status in ('pending', 'partial') and due_date < date.today():
+            status = 'overdue'
+        yield (number, customer, inst_number, _format_date(due_date), amount, paid or 0,
+               STATUS_LABELS.get(status, status), _format_date(payment_date),
+               payment_amount if payment_amount is not None else '', notes or '')
+
+
+INSTALLMENT_HEADER = ('رقم الفاتورة', 'العميل', 'رقم القسط', 'تاريخ الاستحقاق', 'مبلغ القسط', 'المدفوع',
+                      'الحالة', 'تاريخ الدفعة', 'مبلغ الدفعة', 'ملاحظات الدفعة')
+
+
+def daily_report_rows(start, end):
+    s = DailySalesSummary
+    stmt = db.select(
+        s.day, s.invoice_count, s.total_amount, s.paid_amount, s.cash_amount, s.installment_amount
+    ).where(s.day >= start, s.day <= end, s.invoice_count > 0).order_by(s.day)
+    for day, count, total, paid, cash, installment in _stream(stmt):
+        yield _format_date(day), count, total, paid, total - paid, cash, installment
+
+
+DAILY_REPORT_HEADER = ('التاريخ', 'عدد الفواتير', 'إجمالي المبيعات', 'المحصّل', 'المتبقي',
+                       'مبيعات نقدية', 'مبيعات بالتقسيط')
+
+
+def aging_rows(today, customer_ids=None):
+    grouped = aging_by_customer(today, customer_ids).subquery()
+    stmt = db.select(
+        Customer.name, Customer.phone, *[grouped.c[field] for field in AGING_FIELDS]
+    ).join(grouped, grouped.c.customer_id == Customer.id).where(grouped.c.total > 0).order_by(
+        Customer.name, Customer.id
+    )
+    totals = [0] * len(AGING_FIELDS)
+    for name, phone, *amounts in _stream(stmt):
+        totals = [total + amount for total, amount in zip(totals, amounts)]
+        yield (name, phone or '', *amounts)
+    yield ('الإجمالي', '', *totals)
+
+
+AGING_HEADER = ('العميل', 'الهاتف') + tuple(label for _, label, _, _ in AGING_BUCKETS) + ('إجمالي المتبقي',)
+
+
+def stock_rows(at):
+    for product_id, barcode, name, quantity, price in _stream(stock_at(at)):
+        yield (barcode or '', name or f'منتج محذوف #{product_id}', quantity, price if price is not None else '',
+               quantity * price if price is not None else '')
+
+
+STOCK_HEADER = ('الباركود', 'المنتج', 'الكمية', 'السعر', 'القيمة')
@@ -0,0 +1,42 @@
+import gc
+import logging
+import os
+import time
+
+# gunicorn -c gunicorn.conf.py main:app
+#
+# The app is built once in the master and forked into workers, so adding a
+# worker costs a fork instead of a fresh import. create_app() does not touch
+# the database; run `flask --app main migrate` before starting.
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+loglevel = os.environ.get("LOG_LEVEL", "info").lower()
+accesslog = os.environ.get("ACCESS_LOG") or None
+
+_forked_at = {}
+
+
+def when_ready(server):
+    # Objects allocated while preloading are moved out of the collector's
+    # reach so GC passes in workers don't dirty the shared pages.
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    _forked_at["time"] = time.perf_counter()
+
+
+def post_fork(server, worker):
+    from app import db
+    from main import app
+
+    # Connection pools must never be shared across a fork.
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    logging.getLogger("gunicorn.error").info(
+        "worker %s ready %.1fms after fork", worker.pid,
+        (time.perf_counter() - _forked_at.get("time", time.perf_counter())) * 1000
+    )
@@ -0,0 +1,162 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app, g, request, session
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only without it
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                      'application/json', 'image/svg+xml')
+COMPRESS_MIN_SIZE = 500
+STATIC_CACHE_SIZE = 64
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_fingerprints = {}
+_compressed_static = OrderedDict()
+_lock = threading.Lock()
+
+
+def static_fingerprint(filename):
+    # Content hash, recomputed only when the file's mtime changes.
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    cached = _fingerprints.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as handle:
+            cached = _fingerprints[filename] = (mtime, hashlib.sha1(handle.read()).hexdigest()[:12])
+    return cached[1]
+
+
+def _page_version():
+    # Changes whenever templates or static files do, so a deploy never
+    # revalidates an old page as current.
+    version = current_app.extensions.get('page_version')
+    if version is None or current_app.debug:
+        digest = hashlib.sha1()
+        for folder in (current_app.template_folder, current_app.static_folder):
+            folder = os.path.join(current_app.root_path, folder)
+            for root, _, files in sorted(os.walk(folder)):
+                for name in sorted(files):
+                    stat = os.stat(os.path.join(root, name))
+                    digest.update(f'{root}/{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode())
+        version = current_app.extensions['page_version'] = digest.hexdigest()[:12]
+    return version
+
+
+def not_modified(*stamps):
+    # Call at the top of a view with values that change whenever the page
+    # would (row updated_at maxima, counts). Returns a 304 when the client's
+    # copy is still current; otherwise the validators go on the rendered
+    # page. Skipped while flash messages are waiting to be shown.
+    if request.method != 'GET' or session.get('_flashes'):
+        return None
+    etag = hashlib.sha1(repr((_page_version(), request.full_path, stamps)).encode()).hexdigest()
+    # Last-Modified only stands in for the ETag when every stamp is a time;
+    # a count or a date can change without any row getting newer.
+    dates = [stamp for stamp in stamps if stamp is not None]
+    last_modified = None
+    if dates and all(isinstance(stamp, datetime) for stamp in dates):
+        last_modified = max(dates).replace(tzinfo=timezone.utc)
+    g.page_validators = (etag, last_modified)
+    response = current_app.response_class()
+    _set_validators(response, etag, last_modified)
+    response.make_conditional(request)
+    return response if response.status_code == 304 else None
+
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Always revalidate: pages carry balances and stock.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _compressed_asset(response, encoding):
+    # Static files are compressed once per version and encoding.
+    key = (request.path, response.get_etag()[0], encoding)
+    with _lock:
+        body = _compressed_static.get(key)
+        if body is not None:
+            _compressed_static.move_to_end(key)
+            return body
+    body = _compress(response.get_data(), encoding)
+    with _lock:
+        _compressed_static[key] = body
+        while len(_compressed_static) > STATIC_CACHE_SIZE:
+            _compressed_static.popitem(last=False)
+    return body
+
+
+def _maybe_compress(response):
+    response.vary.add('Accept-Encoding')
+    # Streamed exports are left alone; files from send_file are read in.
+    if (response.status_code != 200 or (response.is_streamed and not response.direct_passthrough)
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES
+            or (response.content_length or 0) < COMPRESS_MIN_SIZE):
+        return response
+    encoding = _encoding()
+    if encoding is None:
+        return response
+    if request.endpoint == 'static':
+        response.direct_passthrough = False
+        body = _compressed_asset(response, encoding)
+    else:
+        body = _compress(response.get_data(), encoding)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ from the identity ones, so the validator
+    # can only be weak; weak ETags still match in If-None-Match.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_http_cache(app):
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            fingerprint = static_fingerprint(values['filename'])
+            if fingerprint:
+                values['v'] = fingerprint
+
+    @app.after_request
+    def cache_headers(response):
+        if request.endpoint == 'static':
+            filename = request.view_args.get('filename') if request.view_args else None
+            if filename and request.args.get('v') == static_fingerprint(filename):
+                # The URL changes with the content, so it can be kept forever.
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = IMMUTABLE_MAX_AGE
+                response.cache_control.immutable = True
+        validators = g.pop('page_validators', None)
+        if validators and response.status_code == 200:
+            _set_validators(response, *validators)
+        return _maybe_compress(response)
@@ -0,0 +1,204 @@
+import csv
+import io
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from catalog import bump_catalog_version
+from inventory import record_movements
+from models import Customer, Product
+from report_cache import invalidate_reports
+from search import normalize_search_text
+from sqlcompat import dialect_insert
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 200
+BARCODE_PATTERN = re.compile(r'[0-9A-Za-z\-]{1,100}')
+
+PRODUCT_HEADERS = {
+    'barcode': 'barcode', 'الباركود': 'barcode',
+    'name': 'name', 'الاسم': 'name', 'اسم المنتج': 'name',
+    'price': 'price', 'السعر': 'price',
+    'stock_quantity': 'stock_quantity', 'الكمية': 'stock_quantity',
+    'min_stock_level': 'min_stock_level', 'الحد الأدنى': 'min_stock_level',
+}
+CUSTOMER_HEADERS = {
+    'name': 'name', 'الاسم': 'name',
+    'phone': 'phone', 'الهاتف': 'phone',
+    'address': 'address', 'العنوان': 'address',
+    'notes': 'notes', 'ملاحظات': 'notes',
+}
+
+
+class RowError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def _int_field(value, label, default):
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise RowError(f'{label} غير صحيح: {value}')
+    if number < 0:
+        raise RowError(f'{label} لا يمكن أن يكون سالباً')
+    return number
+
+
+def _product_row(row, now):
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise RowError('اسم المنتج مطلوب')
+    try:
+        price = Decimal((row.get('price') or '').strip())
+        # NaN/Infinity would raise on the comparison below.
+        if not price.is_finite():
+            raise RowError(f'السعر يجب أن يكون رقماً محدداً: {row.get("price")}')
+        price = price.quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f'السعر غير صحيح: {row.get("price")}')
+    if price < 0:
+        raise RowError('السعر لا يمكن أن يكون سالباً')
+    barcode = (row.get('barcode') or '').strip() or None
+    if barcode is not None and not BARCODE_PATTERN.fullmatch(barcode):
+        raise RowError(f'الباركود غير صحيح: {barcode}')
+    return {
+        'barcode': barcode,
+        'name': name,
+        'price': price,
+        'stock_quantity': _int_field(row.get('stock_quantity'), 'الكمية', 0),
+        'min_stock_level': _int_field(row.get('min_stock_level'), 'الحد الأدنى', 5),
+        'search_text': normalize_search_text(f'{name} {barcode or ""}'),
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def _customer_row(row, now):
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise RowError('اسم العميل مطلوب')
+    phone = (row.get('phone') or '').strip()
+    if len(phone) > 20:
+        raise RowError(f'رقم الهاتف طويل جداً: {phone}')
+    return {
+        'name': name,
+        'phone': phone,
+        'address': (row.get('address') or '').strip(),
+        'notes': (row.get('notes') or '').strip(),
+        'search_text': normalize_search_text(f'{name} {phone}'),
+        'created_at': now,
+        'updated_at': now,
+    }
+
+
+def _write_products(rows):
+    keyed = [row for row in rows if row['barcode'] is not None]
+    plain = [row for row in rows if row['barcode'] is None]
+    movements = {}
+    if keyed:
+        # Lock the rows about to be overwritten so the ledger gets the exact change.
+        previous = dict(db.session.execute(
+            db.select(Product.barcode, Product.stock_quantity)
+            .where(Product.barcode.in_([row['barcode'] for row in keyed]))
+            .with_for_update()
+        ).all())
+        stmt = dialect_insert(Product)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Product.barcode],
+            set_={column: stmt.excluded[column] for column in
+                  ('name', 'price', 'stock_quantity', 'min_stock_level', 'search_text', 'updated_at')}
+        ).returning(Product.id, sort_by_parameter_order=True)
+        for row, product_id in zip(keyed, db.session.scalars(stmt, keyed)):
+            movements[product_id] = row['stock_quantity'] - (previous.get(row['barcode']) or 0)
+    if plain:
+        stmt = db.insert(Product).returning(Product.id, sort_by_parameter_order=True)
+        for row, product_id in zip(plain, db.session.scalars(stmt, plain)):
+            movements[product_id] = row['stock_quantity']
+    record_movements('import', movements)
+
+
+def _write_customers(rows):
+    db.session.execute(db.insert(Customer), rows)
+
+
+def _dedupe_barcodes(chunk, result):
+    # One upsert statement may not touch the same row twice; keep the last
+    # occurrence of a barcode within the chunk.
+    last = {}
+    for line, row in chunk:
+        if row['barcode'] is not None:
+            if row['barcode'] in last:
+                result.add_error(last[row['barcode']], f'الباركود {row["barcode"]} مكرر في الملف، تم اعتماد السطر الأخير')
+            last[row['barcode']] = line
+    return [(line, row) for line, row in chunk
+            if row['barcode'] is None or last[row['barcode']] == line]
+
+
+def _run_import(stream, headers, build_row, write_rows, dedupe=None, chunk_size=CHUNK_SIZE):
+    result = ImportResult()
+    reader = csv.DictReader(stream)
+    if not reader.fieldnames or 'name' not in [headers.get(h.strip()) for h in reader.fieldnames]:
+        result.add_error(1, 'الملف لا يحتوي على عمود الاسم (name)')
+        return result
+    columns = {h: headers.get(h.strip()) for h in reader.fieldnames}
+
+    def flush(chunk):
+        if dedupe:
+            chunk = dedupe(chunk, result)
+        if not chunk:
+            return
+        try:
+            write_rows([row for _, row in chunk])
+            db.session.commit()
+            result.imported += len(chunk)
+        except SQLAlchemyError as exc:
+            db.session.rollback()
+            message = str(getattr(exc, 'orig', exc)).splitlines()[0]
+            for line, _ in chunk:
+                result.add_error(line, f'تعذّر حفظ الدفعة: {message}')
+
+    now = datetime.utcnow()
+    chunk = []
+    for raw in reader:
+        line = reader.line_num
+        row = {columns[k]: v for k, v in raw.items() if k is not None and columns.get(k)}
+        try:
+            chunk.append((line, build_row(row, now)))
+        except RowError as exc:
+            result.add_error(line, str(exc))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    flush(chunk)
+    return result
+
+
+def open_csv(binary):
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def import_products(stream, chunk_size=CHUNK_SIZE):
+    result = _run_import(stream, PRODUCT_HEADERS, _product_row, _write_products, _dedupe_barcodes, chunk_size)
+    if result.imported:
+        bump_catalog_version()
+        invalidate_reports()
+    return result
+
+
+def import_customers(stream, chunk_size=CHUNK_SIZE):
+    return _run_import(stream, CUSTOMER_HEADERS, _customer_row, _write_customers, chunk_size=chunk_size)
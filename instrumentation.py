@@ -0,0 +1,154 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import db
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, worker):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(endpoint, list(counts), total, count)
+                        for endpoint, (counts, total, count) in sorted(self._series.items())]
+        for endpoint, counts, total, count in snapshot:
+            labels = f'endpoint="{endpoint}",worker="{worker}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+REQUEST_SECONDS = Histogram('pos_request_duration_seconds', 'Wall time per request.', LATENCY_BUCKETS)
+SQL_SECONDS = Histogram('pos_request_sql_seconds', 'Time spent executing SQL per request.', LATENCY_BUCKETS)
+TEMPLATE_SECONDS = Histogram('pos_request_template_seconds', 'Time spent rendering templates per request.',
+                             LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram('pos_request_queries', 'SQL statements executed per request.', QUERY_BUCKETS)
+HISTOGRAMS = (REQUEST_SECONDS, SQL_SECONDS, TEMPLATE_SECONDS, REQUEST_QUERIES)
+
+
+@contextmanager
+def count_queries():
+    counter = {'count': 0}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter['count'] += 1
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _request_stats():
+    if has_request_context():
+        return g.get('_perf')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._perf_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    started = getattr(context, '_perf_started', None)
+    if stats is not None and started is not None:
+        stats['queries'] += 1
+        stats['sql'] += time.perf_counter() - started
+
+
+def _before_render(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None:
+        stats['template_started'] = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None and stats.get('template_started'):
+        stats['template'] += time.perf_counter() - stats.pop('template_started')
+
+
+def _start_request():
+    g._perf = {'started': time.perf_counter(), 'queries': 0, 'sql': 0.0, 'template': 0.0}
+
+
+def _remember_status(response):
+    g._perf_status = response.status_code
+    return response
+
+
+def _finish_request(app):
+    def finish(exc):
+        stats = g.pop('_perf', None)
+        if stats is None:
+            return
+        wall = time.perf_counter() - stats['started']
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_SECONDS.observe(endpoint, wall)
+        SQL_SECONDS.observe(endpoint, stats['sql'])
+        TEMPLATE_SECONDS.observe(endpoint, stats['template'])
+        REQUEST_QUERIES.observe(endpoint, stats['queries'])
+        if wall * 1000 >= app.config['SLOW_REQUEST_MS']:
+            logger.warning(
+                'slow request %s %s status=%s wall=%.1fms queries=%d sql=%.1fms template=%.1fms',
+                request.method, request.path, g.get('_perf_status', 500), wall * 1000,
+                stats['queries'], stats['sql'] * 1000, stats['template'] * 1000
+            )
+    return finish
+
+
+def metrics():
+    if request.remote_addr not in LOCAL_ADDRESSES:
+        abort(404)
+    worker = os.getpid()
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render(worker))
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+def init_instrumentation(app):
+    app.before_request(_start_request)
+    app.after_request(_remember_status)
+    app.teardown_request(_finish_request(app))
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -0,0 +1,78 @@
+from datetime import datetime, time, timedelta
+from sqlalchemy import func, literal, null, union_all
+from app import db
+from models import Product, StockMovement, StockSnapshot
+
+
+def record_movements(kind, quantities, invoice_id=None):
+    # `quantities` maps product id to the signed change in stock. Written in
+    # the caller's transaction, next to the Product.stock_quantity update.
+    now = datetime.utcnow()
+    rows = [{
+        'product_id': product_id,
+        'kind': kind,
+        'quantity': quantity,
+        'invoice_id': invoice_id,
+        'created_at': now,
+    } for product_id, quantity in sorted(quantities.items()) if quantity]
+    if rows:
+        db.session.execute(db.insert(StockMovement), rows)
+
+
+def take_stock_snapshot():
+    # FOR SHARE waits for in-flight sales holding product row locks, so the
+    # copied quantities already include movements stamped before taken_at.
+    taken_at = datetime.utcnow()
+    db.session.execute(db.insert(StockSnapshot).from_select(
+        ['taken_at', 'product_id', 'quantity', 'price'],
+        db.select(literal(taken_at, db.DateTime), Product.id, Product.stock_quantity, Product.price)
+        .with_for_update(read=True)
+    ))
+    db.session.commit()
+    return taken_at
+
+
+def end_of_day(day):
+    return datetime.combine(day + timedelta(days=1), time.min)
+
+
+def _levels(at):
+    # (product_id, quantity, price) as of `at`: the newest snapshot taken at
+    # or before it plus the movements in between, so only that window of the
+    # ledger is scanned. Without an old enough snapshot, walk back from the
+    # live stock instead.
+    m = StockMovement
+    taken_at = db.session.query(func.max(StockSnapshot.taken_at)).filter(StockSnapshot.taken_at <= at).scalar()
+    if taken_at is None:
+        base = db.select(Product.id.label('product_id'), Product.stock_quantity.label('quantity'),
+                         Product.price.label('price'))
+        delta = db.select(m.product_id, (-m.quantity).label('quantity'), null()).where(m.created_at >= at)
+    else:
+        s = StockSnapshot
+        base = db.select(s.product_id, s.quantity, s.price).where(s.taken_at == taken_at)
+        delta = db.select(m.product_id, m.quantity, null()).where(m.created_at > taken_at, m.created_at < at)
+    rows = union_all(base, delta).subquery()
+    return db.select(
+        rows.c.product_id,
+        func.sum(rows.c.quantity).label('quantity'),
+        func.max(rows.c.price).label('price')
+    ).group_by(rows.c.product_id).subquery()
+
+
+def stock_at(at):
+    # Products first stocked after the snapshot are valued at today's price.
+    levels = _levels(at)
+    return db.select(
+        levels.c.product_id, Product.barcode, Product.name, levels.c.quantity,
+        func.coalesce(levels.c.price, Product.price).label('price')
+    ).outerjoin(Product, Product.id == levels.c.product_id).where(
+        levels.c.quantity != 0
+    ).order_by(Product.name, levels.c.product_id)
+
+
+def inventory_value_at(at):
+    levels = _levels(at)
+    return db.session.execute(
+        db.select(func.sum(levels.c.quantity * func.coalesce(levels.c.price, Product.price)))
+        .select_from(levels.outerjoin(Product, Product.id == levels.c.product_id))
+    ).scalar() or 0
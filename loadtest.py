@@ -0,0 +1,216 @@
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from sqlalchemy import func
+from app import db
+from benchmark import percentile
+from debts import find_debt_mismatches
+from models import Customer, Installment, Invoice, InvoiceItem, Payment, Product
+
+DEFAULT_MIX = {'sale': 6, 'pay': 3, 'delete': 1}
+CENT = Decimal('0.01')
+
+
+class LoadRun:
+    # Shared state of one run. Every invoice it creates carries `marker` in
+    # its notes, which is how the invariants find them afterwards.
+    def __init__(self, hot_products, customer_ids, seed):
+        self.marker = f'loadtest:{uuid.uuid4().hex[:12]}'
+        self.hot_products = hot_products
+        self.customer_ids = customer_ids
+        self.initial_stock = {product_id: stock for product_id, _, stock in hot_products}
+        self.seed = seed
+        self.invoices = []
+        self.deleted = 0
+        self.timings = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.lock = threading.Lock()
+        self.elapsed = 0.0
+
+    def take_invoice(self, rng, remove=False):
+        with self.lock:
+            if not self.invoices:
+                return None
+            index = rng.randrange(len(self.invoices))
+            if remove:
+                self.invoices[index], self.invoices[-1] = self.invoices[-1], self.invoices[index]
+                return self.invoices.pop()
+            return self.invoices[index]
+
+    def record(self, kind, outcome, ms):
+        with self.lock:
+            self.timings[kind].append(ms)
+            self.outcomes[kind][outcome] += 1
+
+
+def _sale(run, client, rng):
+    lines = rng.sample(run.hot_products, k=min(len(run.hot_products), rng.randint(1, 3)))
+    installment = rng.random() < 0.5
+    response = client.post('/sales/new', data={
+        'customer_id': str(rng.choice(run.customer_ids)),
+        'payment_method': 'installment' if installment else 'cash',
+        'num_installments': str(rng.choice([3, 6])),
+        'notes': run.marker,
+        'product_id[]': [str(product_id) for product_id, _, _ in lines],
+        'quantity[]': [str(rng.randint(1, 2)) for _ in lines],
+        'price[]': [str(price) for _, price, _ in lines],
+    })
+    location = response.headers.get('Location', '')
+    if response.status_code == 302 and '/sales/new' not in location:
+        with run.lock:
+            run.invoices.append(int(location.rstrip('/').rsplit('/', 1)[1]))
+        return 'ok'
+    return 'rejected' if response.status_code == 302 else f'http_{response.status_code}'
+
+
+def _pay(run, client, rng):
+    invoice_id = run.take_invoice(rng)
+    if invoice_id is None:
+        return 'skipped'
+    with client.application.app_context():
+        installment_id = db.session.query(Installment.id).filter(
+            Installment.invoice_id == invoice_id, Installment.status != 'paid'
+        ).order_by(Installment.installment_number).limit(1).scalar()
+    if installment_id is None:
+        return 'skipped'
+    amount = Decimal(str(rng.uniform(1, 500))).quantize(CENT)
+    response = client.post(f'/installments/{installment_id}/pay', data={'amount': str(amount), 'notes': run.marker})
+    return 'ok' if response.status_code == 302 else f'http_{response.status_code}'
+
+
+def _delete(run, client, rng):
+    invoice_id = run.take_invoice(rng, remove=True)
+    if invoice_id is None:
+        return 'skipped'
+    response = client.post(f'/sales/{invoice_id}/delete')
+    if response.status_code == 302:
+        with run.lock:
+            run.deleted += 1
+        return 'ok'
+    with run.lock:
+        run.invoices.append(invoice_id)
+    return f'http_{response.status_code}'
+
+
+OPERATIONS = {'sale': _sale, 'pay': _pay, 'delete': _delete}
+
+
+def _till(app, run, till, mix, deadline, rate):
+    # One till: its own client (no cookies, so flashed messages don't pile
+    # up) and, with a rate, a fixed schedule it tries to keep. No app context
+    # is held across requests, so each one gets its own `g` and session.
+    rng = random.Random(f'{run.seed}-{till}')
+    kinds = [kind for kind, weight in mix.items() for _ in range(weight)]
+    client = app.test_client(use_cookies=False)
+    interval = 1.0 / rate if rate else 0
+    next_at = time.perf_counter()
+    while time.perf_counter() < deadline:
+        if interval:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_at += interval
+        kind = rng.choice(kinds)
+        started = time.perf_counter()
+        try:
+            outcome = OPERATIONS[kind](run, client, rng)
+        except Exception as exc:
+            outcome = type(exc).__name__
+        if outcome != 'skipped':
+            run.record(kind, outcome, (time.perf_counter() - started) * 1000)
+
+
+def prepare_run(hot_products=5, seed=0):
+    products = db.session.query(Product.id, Product.price, Product.stock_quantity).filter(
+        Product.stock_quantity > 0
+    ).order_by(Product.stock_quantity.desc(), Product.id).limit(hot_products).all()
+    customer_ids = [row[0] for row in db.session.query(Customer.id).order_by(Customer.id).limit(200)]
+    if not products or not customer_ids:
+        raise RuntimeError('load test needs customers and in-stock products, run generate-data first')
+    db.session.rollback()
+    return LoadRun([tuple(row) for row in products], customer_ids, seed)
+
+
+def run_load_test(app, run, tills=20, duration=10.0, rate=None, mix=None):
+    mix = mix or DEFAULT_MIX
+    started = time.perf_counter()
+    deadline = started + duration
+    with ThreadPoolExecutor(max_workers=tills) as pool:
+        for future in [pool.submit(_till, app, run, till, mix, deadline, rate) for till in range(tills)]:
+            future.result()
+    run.elapsed = time.perf_counter() - started
+    return summarize(run)
+
+
+def summarize(run):
+    rows = {}
+    for kind, timings in sorted(run.timings.items()):
+        rows[kind] = {
+            'count': len(timings),
+            'per_second': round(len(timings) / run.elapsed, 1) if run.elapsed else 0,
+            'p50_ms': round(percentile(timings, 0.50), 1),
+            'p95_ms': round(percentile(timings, 0.95), 1),
+            'p99_ms': round(percentile(timings, 0.99), 1),
+            'max_ms': round(max(timings), 1),
+            'outcomes': dict(run.outcomes[kind]),
+        }
+    return rows
+
+
+def check_invariants(run):
+    violations = []
+
+    duplicates = db.session.query(Invoice.invoice_number, func.count(Invoice.id)).group_by(
+        Invoice.invoice_number
+    ).having(func.count(Invoice.id) > 1).all()
+    for number, count in duplicates:
+        violations.append(f'invoice number {number} issued {count} times')
+
+    live = db.session.query(func.count(Invoice.id)).filter(Invoice.notes == run.marker).scalar()
+    created = run.outcomes['sale']['ok']
+    if live != created - run.deleted:
+        violations.append(f'{created} sales created and {run.deleted} deleted, but {live} invoices remain')
+
+    # Stock moves only through this run's invoices, so what is left must be
+    # the starting stock minus what the surviving invoices hold.
+    sold = dict(db.session.query(InvoiceItem.product_id, func.sum(InvoiceItem.quantity)).join(
+        Invoice, InvoiceItem.invoice_id == Invoice.id
+    ).filter(Invoice.notes == run.marker).group_by(InvoiceItem.product_id).all())
+    current = dict(db.session.query(Product.id, Product.stock_quantity).filter(
+        Product.id.in_(run.initial_stock)
+    ).all())
+    for product_id, initial in sorted(run.initial_stock.items()):
+        expected = initial - (sold.get(product_id) or 0)
+        if current.get(product_id) != expected:
+            violations.append(f'product {product_id}: stock {current.get(product_id)}, expected {expected} '
+                              f'({initial} initial - {sold.get(product_id) or 0} sold)')
+        if (current.get(product_id) or 0) < 0:
+            violations.append(f'product {product_id}: negative stock {current.get(product_id)}')
+
+    # Cash invoices are paid at checkout without Payment rows; installment
+    # invoices are paid only through them.
+    payments = db.session.query(Installment.invoice_id, func.sum(Payment.amount).label('total')).join(
+        Payment, Payment.installment_id == Installment.id
+    ).group_by(Installment.invoice_id).subquery()
+    mismatched = db.session.query(Invoice.invoice_number, Invoice.paid_amount, payments.c.total).outerjoin(
+        payments, payments.c.invoice_id == Invoice.id
+    ).filter(
+        Invoice.notes == run.marker, Invoice.payment_method == 'installment',
+        func.abs(Invoice.paid_amount - func.coalesce(payments.c.total, 0)) >= CENT
+    ).all()
+    for number, paid, total in mismatched:
+        violations.append(f'invoice {number}: paid_amount {paid} but payments sum to {total or 0}')
+
+    overpaid = db.session.query(Installment.id, Installment.amount, Installment.paid_amount).join(
+        Invoice, Installment.invoice_id == Invoice.id
+    ).filter(Invoice.notes == run.marker, Installment.paid_amount - Installment.amount >= CENT).all()
+    for installment_id, amount, paid in overpaid:
+        violations.append(f'installment {installment_id}: paid {paid} of {amount}')
+
+    for customer_id, name, stored, expected in find_debt_mismatches():
+        violations.append(f'customer {customer_id}: balance {stored}, expected {expected}')
+    return violations
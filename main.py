@@ -1,5 +1,8 @@
-from app import app
-from routes import *  # noqa: F401, F403
+import os
+
+from app import create_app
+
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG") == "1")
@@ -0,0 +1,83 @@
+from sqlalchemy import inspect, literal, text
+from app import db
+from search import sync_search_index
+
+# Columns (or whole rollup tables, column None) added after the data they
+# derive from, and the command that fills them in.
+BACKFILLS = {
+    ('daily_sales_summary', None): 'rebuild-daily-sales',
+    ('product_daily_sales', None): 'rebuild-product-sales',
+    ('customers', 'outstanding_balance'): 'check-debts --fix',
+    ('customers', 'search_text'): 'rebuild-search-index',
+    ('products', 'search_text'): 'rebuild-search-index',
+}
+
+
+def _default_sql(column, dialect):
+    if column.server_default is not None:
+        return str(column.server_default.arg)
+    if column.default is not None and column.default.is_scalar:
+        return str(literal(column.default.arg, column.type).compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}
+        ))
+    return None
+
+
+def _add_column_sql(table, column, dialect):
+    sql = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=dialect)}'
+    default = _default_sql(column, dialect)
+    if default is not None:
+        sql += f' DEFAULT {default}'
+        if not column.nullable:
+            sql += ' NOT NULL'
+    return sql
+
+
+def _applies(index, dialect):
+    ddl_if = getattr(index, '_ddl_if', None)
+    return ddl_if is None or ddl_if.dialect is None or ddl_if.dialect == dialect.name
+
+
+def _index_names(conn, inspector, table):
+    # SQLite reflection skips expression indexes; read its catalog directly.
+    if conn.dialect.name == 'sqlite':
+        return set(conn.scalars(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"
+        ), {'table': table.name}))
+    return {index['name'] for index in inspector.get_indexes(table.name)}
+
+
+def migrate_schema():
+    # Brings an existing database up to the models: creates missing tables
+    # (with their indexes and the search triggers/extensions), adds missing
+    # columns and indexes to existing tables, and indexes existing rows for
+    # SQLite search. Never drops or alters anything.
+    actions = []
+    with db.engine.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        db.metadata.create_all(conn)
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing:
+                action = f'created table {table.name}'
+                backfill = BACKFILLS.get((table.name, None))
+                if backfill and existing:
+                    action += f' (then run: flask --app main {backfill})'
+                actions.append(action)
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    conn.execute(text(_add_column_sql(table, column, conn.dialect)))
+                    action = f'added column {table.name}.{column.name}'
+                    backfill = BACKFILLS.get((table.name, column.name))
+                    if backfill:
+                        action += f' (then run: flask --app main {backfill})'
+                    actions.append(action)
+            indexes = _index_names(conn, inspector, table)
+            for index in table.indexes:
+                if index.name not in indexes and _applies(index, conn.dialect):
+                    index.create(conn)
+                    actions.append(f'created index {index.name}')
+        actions.extend(sync_search_index(conn, existing))
+    return actions
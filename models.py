@@ -5,26 +5,39 @@ from app import db
 
 class Customer(db.Model):
     __tablename__ = 'customers'
+    __table_args__ = (
+        db.Index('ix_customers_name_id', 'name', 'id'),
+        db.Index('ix_customers_updated_at', 'updated_at'),
+        db.Index('ix_customers_search_trgm', 'search_text', postgresql_using='gin',
+                 postgresql_ops={'search_text': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     phone = db.Column(db.String(20))
     address = db.Column(db.Text)
     notes = db.Column(db.Text)
+    outstanding_balance = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    search_text = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     invoices = db.relationship('Invoice', backref='customer', lazy='dynamic')
     
     def get_total_debt(self):
-        total = Decimal('0')
-        for invoice in self.invoices:
-            total += invoice.get_remaining_balance()
-        return total
+        return Decimal(str(self.outstanding_balance or 0))
 
 
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_name_id', 'name', 'id'),
+        db.Index('ix_products_updated_at', 'updated_at'),
+        # Serves the low-stock filter below; the expression must match it exactly.
+        db.Index('ix_products_low_stock', db.text('(stock_quantity - min_stock_level)')),
+        db.Index('ix_products_search_trgm', 'search_text', postgresql_using='gin',
+                 postgresql_ops={'search_text': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     barcode = db.Column(db.String(100), unique=True, index=True)
@@ -32,15 +45,25 @@ class Product(db.Model):
     price = db.Column(db.Numeric(12, 2), nullable=False, default=0)
     stock_quantity = db.Column(db.Integer, default=0)
     min_stock_level = db.Column(db.Integer, default=5)
+    search_text = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    @classmethod
+    def low_stock_filter(cls):
+        return cls.stock_quantity - cls.min_stock_level <= 0
+    
     def is_low_stock(self):
         return self.stock_quantity <= self.min_stock_level
 
 
 class Invoice(db.Model):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        db.Index('ix_invoices_created_at_id', 'created_at', 'id'),
+        db.Index('ix_invoices_customer_id', 'customer_id'),
+        db.Index('ix_invoices_updated_at', 'updated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -54,8 +77,10 @@ class Invoice(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    items = db.relationship('InvoiceItem', backref='invoice', lazy='dynamic', cascade='all, delete-orphan')
-    installments = db.relationship('Installment', backref='invoice', lazy='dynamic', cascade='all, delete-orphan')
+    items = db.relationship('InvoiceItem', backref='invoice', cascade='all, delete-orphan',
+                            order_by='InvoiceItem.id')
+    installments = db.relationship('Installment', backref='invoice', cascade='all, delete-orphan',
+                                   order_by='Installment.installment_number')
     
     def get_remaining_balance(self):
         return Decimal(str(self.total_amount)) - Decimal(str(self.paid_amount))
@@ -72,6 +97,9 @@ class Invoice(db.Model):
 
 class InvoiceItem(db.Model):
     __tablename__ = 'invoice_items'
+    __table_args__ = (
+        db.Index('ix_invoice_items_invoice_id', 'invoice_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
@@ -85,6 +113,15 @@ class InvoiceItem(db.Model):
 
 class Installment(db.Model):
     __tablename__ = 'installments'
+    __table_args__ = (
+        db.Index('ix_installments_due_date_id', 'due_date', 'id'),
+        db.Index('ix_installments_invoice_id', 'invoice_id'),
+        db.Index('ix_installments_updated_at', 'updated_at'),
+        # Covers the aging report: open rows only, with every column it reads.
+        db.Index('ix_installments_open', 'invoice_id', 'due_date', 'amount', 'paid_amount',
+                 postgresql_where=db.text("status != 'paid'"),
+                 sqlite_where=db.text("status != 'paid'")),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
@@ -96,7 +133,8 @@ class Installment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
-    payments = db.relationship('Payment', backref='installment', lazy='dynamic', cascade='all, delete-orphan')
+    payments = db.relationship('Payment', backref='installment', cascade='all, delete-orphan',
+                               order_by='Payment.payment_date')
     
     def get_remaining(self):
         return Decimal(str(self.amount)) - Decimal(str(self.paid_amount))
@@ -111,13 +149,136 @@ class Installment(db.Model):
             self.status = 'overdue'
         else:
             self.status = 'pending'
+    
+    def get_effective_status(self, today=None):
+        today = today or date.today()
+        if self.status in ('pending', 'partial') and self.due_date < today:
+            return 'overdue'
+        return self.status
 
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        db.Index('ix_payments_installment_id', 'installment_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     installment_id = db.Column(db.Integer, db.ForeignKey('installments.id'), nullable=False)
     amount = db.Column(db.Numeric(12, 2), nullable=False)
     payment_date = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.Text)
+
+
+class DailySalesSummary(db.Model):
+    __tablename__ = 'daily_sales_summary'
+    
+    day = db.Column(db.Date, primary_key=True)
+    total_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    paid_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    cash_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    installment_amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+
+class ProductDailySales(db.Model):
+    # Per product per day, maintained alongside DailySalesSummary (see rollups.py).
+    __tablename__ = 'product_daily_sales'
+    
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+
+
+class InvoiceCounter(db.Model):
+    __tablename__ = 'invoice_counters'
+    
+    prefix = db.Column(db.String(8), primary_key=True)
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AppSetting(db.Model):
+    __tablename__ = 'app_settings'
+    
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.String(200))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @classmethod
+    def get_value(cls, key, default=None):
+        setting = db.session.get(cls, key)
+        return setting.value if setting else default
+    
+    @classmethod
+    def set_value(cls, key, value):
+        setting = db.session.get(cls, key)
+        if setting is None:
+            setting = cls(key=key)
+            db.session.add(setting)
+        setting.value = value
+
+
+class SaleRequest(db.Model):
+    # Idempotency keys of sales posted by tills (see sales.py). No foreign
+    # key: a replay after the invoice is archived or deleted must still be
+    # recognised.
+    __tablename__ = 'sale_requests'
+    
+    key = db.Column(db.String(100), primary_key=True)
+    invoice_id = db.Column(db.Integer, nullable=False)
+    invoice_number = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class StockMovement(db.Model):
+    # Append-only: every change to Product.stock_quantity also writes a row
+    # here (see inventory.py). No foreign keys, so history outlives products.
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_created_at', 'created_at'),
+        db.Index('ix_stock_movements_product_id_created_at', 'product_id', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # sale, return, adjustment, import
+    quantity = db.Column(db.Integer, nullable=False)
+    invoice_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class StockSnapshot(db.Model):
+    __tablename__ = 'stock_snapshots'
+    
+    taken_at = db.Column(db.DateTime, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Numeric(12, 2), nullable=False)
+
+
+def _archive_table(table, *indexes):
+    # Same columns as the live table, minus foreign keys, so archived rows
+    # outlive the products and customers they reference.
+    columns = [db.Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in table.columns]
+    return db.Table(f'{table.name}_archive', *columns, *indexes)
+
+
+# Fully paid invoices past the archive horizon, with their children (see archive.py).
+invoices_archive = _archive_table(
+    Invoice.__table__,
+    db.Index('ix_invoices_archive_created_at_id', 'created_at', 'id'),
+    db.Index('ix_invoices_archive_customer_id', 'customer_id'),
+)
+invoice_items_archive = _archive_table(
+    InvoiceItem.__table__,
+    db.Index('ix_invoice_items_archive_invoice_id', 'invoice_id'),
+)
+installments_archive = _archive_table(
+    Installment.__table__,
+    db.Index('ix_installments_archive_invoice_id', 'invoice_id'),
+)
+payments_archive = _archive_table(
+    Payment.__table__,
+    db.Index('ix_payments_archive_installment_id', 'installment_id'),
+)
@@ -0,0 +1,42 @@
+from datetime import datetime
+from sqlalchemy import Integer, cast, func
+from app import db
+from models import Invoice, InvoiceCounter
+from sqlcompat import dialect_insert
+
+
+def _allocate(conn, prefix):
+    counter = InvoiceCounter.__table__
+    number = conn.execute(
+        counter.update()
+        .where(counter.c.prefix == prefix)
+        .values(last_number=counter.c.last_number + 1)
+        .returning(counter.c.last_number)
+    ).scalar()
+    if number is not None:
+        return number
+
+    # First invoice of the day: seed from any numbers issued before the
+    # counter existed, racing allocators resolve through the conflict clause.
+    issued = db.select(
+        func.coalesce(func.max(cast(func.substr(Invoice.invoice_number, len(prefix) + 1), Integer)), 0) + 1
+    ).where(Invoice.invoice_number.like(f'{prefix}%')).scalar_subquery()
+    stmt = dialect_insert(InvoiceCounter).values(prefix=prefix, last_number=issued)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[counter.c.prefix],
+        set_={'last_number': counter.c.last_number + 1}
+    ).returning(counter.c.last_number)
+    return conn.execute(stmt).scalar()
+
+
+def next_invoice_number(now=None):
+    prefix = (now or datetime.now()).strftime('%Y%m%d')
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # Allocate in a short transaction of its own so the counter row lock
+        # is not held for the rest of the checkout; a rolled back sale only
+        # leaves a gap in the sequence.
+        with db.engine.begin() as conn:
+            number = _allocate(conn, prefix)
+    else:
+        number = _allocate(db.session, prefix)
+    return f'{prefix}{number:04d}'
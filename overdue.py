@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+from datetime import date
+from sqlalchemy import and_, or_
+from app import db
+from models import AppSetting, Installment
+
+logger = logging.getLogger(__name__)
+
+LAST_SWEPT_KEY = 'overdue_last_swept'
+OPEN_STATUSES = ('pending', 'partial')
+
+
+def get_last_swept():
+    value = AppSetting.get_value(LAST_SWEPT_KEY)
+    return date.fromisoformat(value) if value else None
+
+
+def is_swept(today=None):
+    last_swept = get_last_swept()
+    return last_swept is not None and last_swept >= (today or date.today())
+
+
+def sweep_overdue(today=None):
+    today = today or date.today()
+    result = db.session.execute(
+        db.update(Installment)
+        .where(Installment.due_date < today, Installment.status.in_(OPEN_STATUSES))
+        .values(status='overdue'),
+        execution_options={'synchronize_session': False}
+    )
+    AppSetting.set_value(LAST_SWEPT_KEY, today.isoformat())
+    db.session.commit()
+    return result.rowcount
+
+
+def status_filter(status, today=None):
+    # Until today's sweep has run, stored statuses of past-due rows are stale,
+    # so derive "overdue" from the due date instead of writing it on read.
+    today = today or date.today()
+    if is_swept(today):
+        return Installment.status == status
+    past_due = and_(Installment.status.in_(OPEN_STATUSES), Installment.due_date < today)
+    if status == 'overdue':
+        return or_(Installment.status == 'overdue', past_due)
+    if status in OPEN_STATUSES:
+        return and_(Installment.status == status, Installment.due_date >= today)
+    return Installment.status == status
+
+
+def start_overdue_sweeper(app):
+    interval = app.config.get('OVERDUE_SWEEP_INTERVAL', 0)
+    if not interval:
+        return None
+
+    def run():
+        while True:
+            try:
+                with app.app_context():
+                    if not is_swept():
+                        count = sweep_overdue()
+                        logger.info('Marked %s installment(s) overdue', count)
+            except Exception:
+                logger.exception('Overdue sweep failed')
+            stop.wait(interval)
+
+    stop = threading.Event()
+    thread = threading.Thread(target=run, name='overdue-sweeper', daemon=True)
+    thread.start()
+    return stop
+
+
+def init_overdue_sweeper(app):
+    # Started from the first request in each process rather than at import,
+    # so a preloading gunicorn master and CLI commands never run it, and
+    # every forked worker gets its own thread.
+    started = {'pid': None}
+
+    def ensure_started():
+        if started['pid'] != os.getpid():
+            started['pid'] = os.getpid()
+            start_overdue_sweeper(app)
+
+    app.before_request(ensure_started)
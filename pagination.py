@@ -0,0 +1,106 @@
+import base64
+import json
+from datetime import date, datetime
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps([_encode_value(v) for v in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(columns, cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if len(values) != len(columns):
+            return None
+        return [_decode_value(c, v) for c, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _url(self, **cursor):
+        args = request.args.to_dict()
+        args.pop('after', None)
+        args.pop('before', None)
+        args.update(cursor)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+    @property
+    def next_url(self):
+        return self._url(after=self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self):
+        return self._url(before=self.prev_cursor) if self.prev_cursor else None
+
+
+def get_per_page():
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+
+def paginate_keyset(query, columns, descending=False, per_page=None, after=None, before=None):
+    # `columns` must form a unique key (end with the primary key) and be
+    # covered by a composite index, so every page is a single index range scan.
+    per_page = per_page or get_per_page()
+    after = decode_cursor(columns, after) if after else None
+    before = decode_cursor(columns, before) if before and not after else None
+    key = tuple_(*columns)
+
+    backwards = before is not None
+    if after is not None:
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    elif backwards:
+        query = query.filter(key > tuple_(*before) if descending else key < tuple_(*before))
+
+    reverse = descending != backwards
+    query = query.order_by(*[c.desc() if reverse else c.asc() for c in columns])
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def cursor_for(row):
+        return encode_cursor([getattr(row, c.key) for c in columns])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = cursor_for(rows[-1])
+        if (has_more and backwards) or after is not None:
+            prev_cursor = cursor_for(rows[0])
+    return KeysetPage(rows, next_cursor, prev_cursor)
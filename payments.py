@@ -0,0 +1,196 @@
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import bindparam, case, func, or_
+from aging import OPEN_INSTALLMENT
+from app import db
+from debts import adjust_customer_debts
+from models import Customer, Installment, Invoice, Payment
+from rollups import record_collections
+from sqlcompat import lock_rows
+
+CENT = Decimal('0.01')
+
+
+class CollectionEntry:
+    # One collected amount, addressed by invoice number, customer id or
+    # customer phone. `line` is the position reported back on errors.
+    def __init__(self, line, amount, invoice_number=None, customer_id=None, phone=None, notes=''):
+        self.line = line
+        self.amount = amount
+        self.invoice_number = invoice_number
+        self.customer_id = customer_id
+        self.phone = phone
+        self.notes = notes
+        self.invoice_id = None
+        self.applied = Decimal('0')
+
+
+class CollectionResult:
+    def __init__(self):
+        self.entries = []
+        self.errors = []
+        self.payments = 0
+        self.installments = 0
+        self.invoices = 0
+        self.days = []
+
+    @property
+    def applied(self):
+        return sum((entry.applied for entry in self.entries), Decimal('0'))
+
+    @property
+    def unallocated(self):
+        return [(entry, entry.amount - entry.applied) for entry in self.entries if entry.amount > entry.applied]
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(str(value).strip().replace(',', '.')).quantize(CENT)
+    except (InvalidOperation, ValueError):
+        return None
+    return amount if amount.is_finite() and amount > 0 else None
+
+
+def parse_collection_text(text):
+    # "reference, amount[, notes]" per line; reference is an invoice number
+    # or the customer's phone.
+    entries, errors = [], []
+    for line, raw in enumerate(text.splitlines(), start=1):
+        if not raw.strip():
+            continue
+        parts = [part.strip() for part in raw.split(',', 2)]
+        if len(parts) < 2 or not parts[0]:
+            errors.append((line, 'يجب كتابة المرجع والمبلغ مفصولين بفاصلة'))
+            continue
+        amount = parse_amount(parts[1])
+        if amount is None:
+            errors.append((line, f'المبلغ غير صحيح: {parts[1]}'))
+            continue
+        entries.append(CollectionEntry(line, amount, invoice_number=parts[0], phone=parts[0],
+                                       notes=parts[2] if len(parts) > 2 else ''))
+    return entries, errors
+
+
+def _resolve(entries):
+    errors = []
+    numbers = {e.invoice_number for e in entries if e.invoice_number}
+    invoices = dict(db.session.query(Invoice.invoice_number, Invoice.id).filter(
+        Invoice.invoice_number.in_(numbers)
+    ).all()) if numbers else {}
+    phones = {e.phone for e in entries if e.phone and e.invoice_number not in invoices}
+    by_phone = defaultdict(list)
+    if phones:
+        for customer_id, phone in db.session.query(Customer.id, Customer.phone).filter(Customer.phone.in_(phones)):
+            by_phone[phone].append(customer_id)
+    customer_ids = {e.customer_id for e in entries if e.customer_id}
+    known = {row[0] for row in db.session.query(Customer.id).filter(Customer.id.in_(customer_ids))} if customer_ids else set()
+    for entry in entries:
+        if entry.invoice_number in invoices:
+            entry.invoice_id = invoices[entry.invoice_number]
+        elif entry.customer_id:
+            if entry.customer_id not in known:
+                errors.append((entry.line, f'العميل غير موجود: {entry.customer_id}'))
+        elif entry.phone and len(by_phone.get(entry.phone, ())) == 1:
+            entry.customer_id = by_phone[entry.phone][0]
+        elif entry.phone and by_phone.get(entry.phone):
+            errors.append((entry.line, f'أكثر من عميل بنفس رقم الهاتف: {entry.phone}'))
+        else:
+            errors.append((entry.line, f'لا توجد فاتورة أو عميل بهذا المرجع: {entry.invoice_number or entry.phone}'))
+    return errors
+
+
+def _open_installments(entries):
+    invoice_ids = {e.invoice_id for e in entries if e.invoice_id}
+    customer_ids = {e.customer_id for e in entries if not e.invoice_id}
+    matching = or_(Invoice.id.in_(invoice_ids), Invoice.customer_id.in_(customer_ids))
+    # Lock before reading, so two batches (or a batch and the single-payment
+    # form) can't allocate the same balance twice. Oldest due first.
+    lock_rows(Installment, OPEN_INSTALLMENT, Installment.invoice_id.in_(db.select(Invoice.id).where(matching)))
+    return db.session.query(
+        Installment.id, Installment.invoice_id, Invoice.customer_id, Invoice.created_at,
+        Installment.amount, Installment.paid_amount
+    ).join(Invoice, Installment.invoice_id == Invoice.id).filter(
+        OPEN_INSTALLMENT, matching
+    ).order_by(
+        Installment.due_date, Installment.installment_number, Installment.id
+    ).all()
+
+
+def _allocate(entries, rows):
+    remaining = {row.id: Decimal(str(row.amount)) - Decimal(str(row.paid_amount or 0)) for row in rows}
+    by_invoice, by_customer = defaultdict(list), defaultdict(list)
+    for row in rows:
+        by_invoice[row.invoice_id].append(row)
+        by_customer[row.customer_id].append(row)
+    allocations = []
+    for entry in entries:
+        queue = by_invoice[entry.invoice_id] if entry.invoice_id else by_customer[entry.customer_id]
+        left = entry.amount
+        for row in queue:
+            if left <= 0:
+                break
+            share = min(left, remaining[row.id])
+            if share <= 0:
+                continue
+            remaining[row.id] -= share
+            left -= share
+            allocations.append((entry, row, share))
+        entry.applied = entry.amount - left
+    return allocations
+
+
+def _add_to_paid(table, total_column, deltas, now):
+    # executemany of one relative UPDATE; statuses are derived in SQL from
+    # the pre-update values on the same row.
+    paid = func.coalesce(table.c.paid_amount, 0) + bindparam('delta')
+    stmt = table.update().where(table.c.id == bindparam('row_id')).values(
+        paid_amount=paid,
+        status=case((table.c[total_column] <= paid, 'paid'), else_='partial'),
+        updated_at=now
+    )
+    db.session.connection().execute(stmt, [
+        {'row_id': row_id, 'delta': delta} for row_id, delta in sorted(deltas.items())
+    ])
+
+
+def collect_payments(entries, notes=''):
+    # Allocates every entry FIFO across the oldest open installments and
+    # posts the whole batch in the caller's transaction; nothing is written
+    # if any entry fails to resolve.
+    result = CollectionResult()
+    result.entries = entries
+    result.errors = _resolve(entries)
+    if result.errors or not entries:
+        return result
+    allocations = _allocate(entries, _open_installments(entries))
+    if not allocations:
+        return result
+
+    now = datetime.utcnow()
+    installment_deltas = defaultdict(Decimal)
+    invoice_deltas = defaultdict(Decimal)
+    customer_deltas = defaultdict(Decimal)
+    day_deltas = defaultdict(Decimal)
+    for entry, row, share in allocations:
+        installment_deltas[row.id] += share
+        invoice_deltas[row.invoice_id] += share
+        customer_deltas[row.customer_id] -= share
+        day_deltas[row.created_at.date()] += share
+
+    db.session.execute(db.insert(Payment), [{
+        'installment_id': row.id,
+        'amount': share,
+        'payment_date': now,
+        'notes': entry.notes or notes,
+    } for entry, row, share in allocations])
+    _add_to_paid(Installment.__table__, 'amount', installment_deltas, now)
+    _add_to_paid(Invoice.__table__, 'total_amount', invoice_deltas, now)
+    adjust_customer_debts(customer_deltas)
+    record_collections(day_deltas)
+
+    result.payments = len(allocations)
+    result.installments = len(installment_deltas)
+    result.invoices = len(invoice_deltas)
+    result.days = sorted(day_deltas)
+    return result
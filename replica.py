@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from functools import wraps
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'
+LAST_WRITE_KEY = 'last_write'
+LAG_CHECK_INTERVAL = 5.0
+
+_lag_lock = threading.Lock()
+_lag_state = {'checked_at': 0.0, 'lag': 0.0}
+
+
+# Sends plain reads to the replica bind while a @replica_reads view is
+# running. Flushes and INSERT/UPDATE/DELETE statements always go to the
+# primary, whatever the view is marked as.
+class RoutingSession(Session):
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and reading_from_replica() and not self._flushing and not getattr(clause, 'is_dml', False):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def reading_from_replica():
+    return has_request_context() and g.get('read_replica', False)
+
+
+def _replica_engine():
+    return current_app.extensions['sqlalchemy'].engines.get(REPLICA_BIND)
+
+
+def replica_lag(engine):
+    # Seconds the replica is behind, re-measured at most every
+    # LAG_CHECK_INTERVAL. Only PostgreSQL streaming replicas report it; an
+    # idle primary makes it grow too, which only costs a fallback.
+    now = time.monotonic()
+    if now - _lag_state['checked_at'] < LAG_CHECK_INTERVAL:
+        return _lag_state['lag']
+    with _lag_lock:
+        if now - _lag_state['checked_at'] >= LAG_CHECK_INTERVAL:
+            lag = 0.0
+            if engine.dialect.name == 'postgresql':
+                try:
+                    with engine.connect() as conn:
+                        lag = conn.execute(text(
+                            'SELECT CASE WHEN pg_is_in_recovery() THEN COALESCE('
+                            'EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END'
+                        )).scalar() or 0.0
+                except Exception:
+                    logger.exception('replica lag check failed')
+                    lag = float('inf')
+            _lag_state['lag'] = float(lag)
+            _lag_state['checked_at'] = now
+    return _lag_state['lag']
+
+
+def _recently_wrote(max_lag):
+    last_write = session.get(LAST_WRITE_KEY)
+    return last_write is not None and time.time() - last_write < max_lag
+
+
+def replica_reads(view):
+    # Marks a GET view whose numbers may be REPLICA_MAX_LAG seconds stale.
+    # Browsers that wrote within that window stay on the primary so they
+    # see their own sale or payment.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        engine = _replica_engine()
+        max_lag = current_app.config.get('REPLICA_MAX_LAG', 5)
+        if (engine is not None and request.method in ('GET', 'HEAD')
+                and not _recently_wrote(max_lag) and replica_lag(engine) <= max_lag):
+            g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _remember_write(response):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        session[LAST_WRITE_KEY] = time.time()
+    return response
+
+
+def init_replica(app):
+    if REPLICA_BIND in app.config.get('SQLALCHEMY_BINDS', {}):
+        app.after_request(_remember_write)
+
+
+def sync_sqlite_replica():
+    # Local stand-in for streaming replication: copy the primary SQLite
+    # file over the replica with the online backup API.
+    engines = current_app.extensions['sqlalchemy'].engines
+    primary, replica = engines[None], engines.get(REPLICA_BIND)
+    if replica is None or primary.dialect.name != 'sqlite' or replica.dialect.name != 'sqlite':
+        raise RuntimeError('sync-replica needs SQLite for both the primary and the replica bind')
+    source = primary.raw_connection()
+    target = replica.raw_connection()
+    try:
+        source.driver_connection.backup(target.driver_connection)
+    finally:
+        target.close()
+        source.close()
+    replica.dispose()
@@ -0,0 +1,209 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import current_app, g, has_request_context
+from app import db
+from models import AppSetting
+from replica import reading_from_replica
+from sqlcompat import dialect_insert
+
+# Report results are keyed on their inputs plus the generation tokens of
+# the data they read. Writers bump a token instead of deleting entries, so
+# stale results simply stop being looked up and age out of the LRU.
+# Range aggregates depend on one token per calendar month they cover; the
+# stock/balance snapshot depends on a single 'current' token, and every
+# result on 'all', which rebuilds bump. The tokens live in app_settings so
+# a write on one worker reaches every worker's cache, whatever the backend.
+CURRENT = 'current'
+ALL = 'all'
+GENERATION_PREFIX = 'report_generation:'
+
+
+def _new_token():
+    # Bump time first, so readers can tell how recent the last write was.
+    return f'{time.time():.3f}-{uuid.uuid4().hex}'
+
+
+def _bumped_within(tokens, seconds):
+    newest = max((float(token.split('-', 1)[0]) for token in tokens), default=0.0)
+    return time.time() - newest < seconds
+
+
+class MemoryBackend:
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Pickled entries in a directory on local disk, shared by every worker on
+# the host. File mtimes double as the LRU clock.
+class FileBackend:
+
+    def __init__(self, directory, max_entries=256):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, prefix, name):
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{prefix}-{digest}')
+
+    def _write(self, path, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, key):
+        path = self._path('entry', key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def set(self, key, value):
+        self._write(self._path('entry', key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith('entry-'):
+                    try:
+                        entries.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith('entry-'):
+                    os.remove(entry.path)
+
+
+def create_backend(config):
+    size = config.get('REPORT_CACHE_SIZE', 256)
+    if config.get('REPORT_CACHE_BACKEND', 'memory') == 'file':
+        directory = config.get('REPORT_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'report-cache')
+        return FileBackend(directory, size)
+    return MemoryBackend(size)
+
+
+def get_backend():
+    backend = current_app.extensions.get('report_cache')
+    if backend is None:
+        backend = current_app.extensions['report_cache'] = create_backend(current_app.config)
+    return backend
+
+
+def _generations(names):
+    # Read from the primary: a lagging replica would hand back the token
+    # from before the write. Loaded once per request, since a page asks
+    # for several reports.
+    tokens = g.get('report_generations') if has_request_context() else None
+    if tokens is None:
+        tokens = dict(db.session.execute(
+            db.select(AppSetting.key, AppSetting.value).where(AppSetting.key.startswith(GENERATION_PREFIX)),
+            bind_arguments={'bind': db.engine}
+        ).all())
+        if has_request_context():
+            g.report_generations = tokens
+    return [tokens.get(GENERATION_PREFIX + name, '0-0') for name in names]
+
+
+def _bump(names):
+    # A fresh random token per bump, so concurrent bumps cannot cancel out.
+    # Commits on its own, like the catalog version.
+    token = _new_token()
+    stmt = dialect_insert(AppSetting)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[AppSetting.key],
+        set_={'value': stmt.excluded.value}
+    ), [{'key': GENERATION_PREFIX + name, 'value': token} for name in sorted(set(names))])
+    db.session.commit()
+    if has_request_context():
+        g.pop('report_generations', None)
+
+
+def _month_names(start, end):
+    year, month = start.year, start.month
+    names = []
+    while (year, month) <= (end.year, end.month):
+        names.append(f'month:{year}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return names
+
+
+def cached_report(name, compute, start=None, end=None):
+    backend = get_backend()
+    if start is None:
+        dependencies = [ALL, CURRENT]
+        key = [name]
+    else:
+        dependencies = [ALL] + _month_names(start, end)
+        key = [name, start.isoformat(), end.isoformat()]
+    tokens = _generations(dependencies)
+    key = '|'.join(key + tokens)
+    value = backend.get(key)
+    if value is None:
+        value = compute()
+        # A replica may not have replayed the write behind a fresh token yet;
+        # serve that result but don't let it stand in for the new generation.
+        max_lag = current_app.config.get('REPLICA_MAX_LAG', 5)
+        if not (reading_from_replica() and _bumped_within(tokens, max_lag)):
+            backend.set(key, value)
+    return value
+
+
+def invalidate_reports(*days):
+    # Call after the write has committed: a bump that lands before the commit
+    # lets a concurrent reader cache pre-commit numbers under the new token.
+    # Pass the invoice dates whose daily totals changed; with no dates only
+    # the stock/balance snapshot is dropped.
+    names = [CURRENT]
+    for day in days:
+        names.extend(_month_names(day, day))
+    _bump(names)
+
+
+def clear_report_cache():
+    # Other workers' entries go stale through the shared 'all' token.
+    _bump([ALL])
+    get_backend().clear()
@@ -0,0 +1,135 @@
+from decimal import Decimal
+from sqlalchemy import case, func
+from app import db
+from archive import invoice_history, invoice_item_history
+from models import DailySalesSummary, ProductDailySales
+from report_cache import clear_report_cache
+from sqlcompat import dialect_insert
+
+SUMMARY_FIELDS = ('total_amount', 'paid_amount', 'invoice_count', 'cash_amount', 'installment_amount')
+
+
+def _apply_daily_delta(day, **deltas):
+    row = {field: deltas.get(field, 0) for field in SUMMARY_FIELDS}
+    stmt = dialect_insert(DailySalesSummary).values(day=day, **row)
+    table = DailySalesSummary.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.day],
+        set_={field: table.c[field] + stmt.excluded[field] for field in deltas}
+    )
+    db.session.execute(stmt)
+
+
+def _invoice_deltas(invoice, sign):
+    total = Decimal(str(invoice.total_amount)) * sign
+    return {
+        'total_amount': total,
+        'paid_amount': Decimal(str(invoice.paid_amount)) * sign,
+        'invoice_count': sign,
+        'cash_amount' if invoice.payment_method == 'cash' else 'installment_amount': total,
+    }
+
+
+def record_sale(invoice):
+    _apply_daily_delta(invoice.created_at.date(), **_invoice_deltas(invoice, 1))
+
+
+def record_payment(invoice, amount):
+    _apply_daily_delta(invoice.created_at.date(), paid_amount=amount)
+
+
+def record_collections(amounts_by_day):
+    for day in sorted(amounts_by_day):
+        _apply_daily_delta(day, paid_amount=amounts_by_day[day])
+
+
+def remove_sale(invoice):
+    _apply_daily_delta(invoice.created_at.date(), **_invoice_deltas(invoice, -1))
+
+
+def record_product_sales(day, items, sign=1):
+    # `items` are (product_id, quantity, total_price); one executemany upsert
+    # with the lines of an invoice merged per product.
+    merged = {}
+    for product_id, quantity, total in items:
+        previous = merged.get(product_id, (0, Decimal('0')))
+        merged[product_id] = (previous[0] + quantity, previous[1] + Decimal(str(total)))
+    if not merged:
+        return
+    table = ProductDailySales.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.day, table.c.product_id],
+        set_={field: table.c[field] + stmt.excluded[field] for field in ('quantity', 'revenue')}
+    )
+    db.session.connection().execute(stmt, [
+        {'day': day, 'product_id': product_id, 'quantity': quantity * sign, 'revenue': revenue * sign}
+        for product_id, (quantity, revenue) in sorted(merged.items())
+    ])
+
+
+def rebuild_daily_sales():
+    invoices = invoice_history()
+    day = func.date(invoices.c.created_at)
+    is_cash = invoices.c.payment_method == 'cash'
+    summary = db.select(
+        day,
+        func.sum(invoices.c.total_amount),
+        func.sum(invoices.c.paid_amount),
+        func.count(invoices.c.id),
+        func.sum(case((is_cash, invoices.c.total_amount), else_=0)),
+        func.sum(case((is_cash, 0), else_=invoices.c.total_amount)),
+    ).group_by(day)
+    db.session.execute(db.delete(DailySalesSummary))
+    result = db.session.execute(
+        db.insert(DailySalesSummary).from_select(('day',) + SUMMARY_FIELDS, summary)
+    )
+    db.session.commit()
+    clear_report_cache()
+    return result.rowcount
+
+
+def rebuild_product_sales():
+    invoices = invoice_history()
+    items = invoice_item_history()
+    day = func.date(invoices.c.created_at)
+    summary = db.select(
+        day, items.c.product_id, func.sum(items.c.quantity), func.sum(items.c.total_price)
+    ).join(invoices, items.c.invoice_id == invoices.c.id).group_by(day, items.c.product_id)
+    db.session.execute(db.delete(ProductDailySales))
+    result = db.session.execute(
+        db.insert(ProductDailySales).from_select(('day', 'product_id', 'quantity', 'revenue'), summary)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def sales_totals(today):
+    month_start = today.replace(day=1)
+    year_start = today.replace(month=1, day=1)
+    s = DailySalesSummary
+    row = db.session.query(
+        func.sum(case((s.day == today, s.total_amount), else_=0)),
+        func.sum(case((s.day >= month_start, s.total_amount), else_=0)),
+        func.sum(case((s.day >= year_start, s.total_amount), else_=0)),
+        func.sum(s.paid_amount),
+    ).one()
+    return [value or 0 for value in row]
+
+
+def range_totals(start, end):
+    s = DailySalesSummary
+    row = db.session.query(
+        func.sum(s.total_amount),
+        func.sum(s.paid_amount),
+        func.sum(s.invoice_count),
+    ).filter(s.day >= start, s.day <= end).one()
+    return [value or 0 for value in row]
+
+
+def daily_sales_series(start, end):
+    s = DailySalesSummary
+    return db.session.query(
+        s.day.label('date'),
+        s.total_amount.label('total')
+    ).filter(s.day >= start, s.day <= end, s.invoice_count > 0).order_by(s.day).all()
@@ -1,65 +1,83 @@
-from datetime import datetime, timedelta, date
+from collections import defaultdict
+from datetime import datetime, date
 from decimal import Decimal
-from flask import render_template, request, redirect, url_for, flash, jsonify
-from sqlalchemy import func, or_
-from app import app, db
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, abort
+from sqlalchemy import func
+from sqlalchemy.orm import contains_eager, joinedload, selectinload
+from app import db
 from models import Customer, Product, Invoice, InvoiceItem, Installment, Payment
+from aging import AGING_BUCKETS, aging_report_query, aging_totals
+from analytics import VELOCITY_DAYS, product_sales_totals, slow_movers, top_products
+from archive import customer_invoices, has_archived_invoices
+from catalog import bump_catalog_version, catalog, product_dict
+from debts import adjust_customer_debt
+from exports import (
+    AGING_HEADER, DAILY_REPORT_HEADER, INSTALLMENT_HEADER, INVOICE_HEADER, STOCK_HEADER,
+    aging_rows, csv_response, daily_report_rows, installment_rows, invoice_rows, stock_rows
+)
+from http_cache import not_modified
+from imports import import_customers, import_products, open_csv
+from inventory import end_of_day, inventory_value_at, record_movements
+from overdue import status_filter
+from payments import CollectionEntry, collect_payments, parse_amount, parse_collection_text
+from pagination import KeysetPage, paginate_keyset
+from replica import replica_reads
+from report_cache import cached_report, invalidate_reports
+from rollups import (
+    daily_sales_series, range_totals, record_payment, record_product_sales, remove_sale, sales_totals
+)
+from sales import SaleEntry, create_sale, submit_sales
+from search import search_customers, search_products
+from sqlcompat import lock_rows
+from stock import release_stock
+
+INITIAL_PICK_LIMIT = 20
+MAX_SALE_BATCH = 500
+
+bp = Blueprint('pos', __name__)
+
+
+def get_date_range():
+    today = date.today()
+    start_date = request.args.get('start_date', today.replace(day=1).strftime('%Y-%m-%d'))
+    end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+    return start_date, end_date, start, end
 
 
-def generate_invoice_number():
-    today = datetime.now()
-    prefix = today.strftime('%Y%m%d')
-    last_invoice = Invoice.query.filter(
-        Invoice.invoice_number.like(f'{prefix}%')
-    ).order_by(Invoice.id.desc()).first()
-    
-    if last_invoice:
-        last_num = int(last_invoice.invoice_number[-4:])
-        new_num = last_num + 1
-    else:
-        new_num = 1
-    
-    return f'{prefix}{new_num:04d}'
-
-
-@app.route('/')
+@bp.route('/')
+@replica_reads
 def dashboard():
     today = date.today()
-    month_start = today.replace(day=1)
-    year_start = today.replace(month=1, day=1)
-    
-    daily_sales = db.session.query(func.sum(Invoice.total_amount)).filter(
-        func.date(Invoice.created_at) == today
-    ).scalar() or 0
-    
-    monthly_sales = db.session.query(func.sum(Invoice.total_amount)).filter(
-        Invoice.created_at >= month_start
-    ).scalar() or 0
-    
-    yearly_sales = db.session.query(func.sum(Invoice.total_amount)).filter(
-        Invoice.created_at >= year_start
-    ).scalar() or 0
-    
-    total_received = db.session.query(func.sum(Invoice.paid_amount)).scalar() or 0
-    total_pending = db.session.query(func.sum(Invoice.total_amount - Invoice.paid_amount)).filter(
-        Invoice.status != 'paid'
-    ).scalar() or 0
-    
-    recent_invoices = Invoice.query.order_by(Invoice.created_at.desc()).limit(5).all()
-    
-    low_stock_products = Product.query.filter(
-        Product.stock_quantity <= Product.min_stock_level
-    ).all()
-    
-    overdue_installments = Installment.query.filter(
+    # Every figure on the page moves one of these (sales and payments touch
+    # invoices, stock moves touch products, balances touch customers).
+    cached = not_modified(today, *db.session.execute(db.select(
+        db.select(func.max(Customer.updated_at)).scalar_subquery(),
+        db.select(func.count(Customer.id)).scalar_subquery(),
+        db.select(func.max(Product.updated_at)).scalar_subquery(),
+        db.select(func.count(Product.id)).scalar_subquery(),
+        db.select(func.max(Invoice.updated_at)).scalar_subquery(),
+        db.select(func.max(Installment.updated_at)).scalar_subquery(),
+    )).one())
+    if cached:
+        return cached
+    
+    daily_sales, monthly_sales, yearly_sales, total_received = sales_totals(today)
+    total_pending = db.session.query(func.sum(Customer.outstanding_balance)).scalar() or 0
+    
+    recent_invoices = Invoice.query.options(joinedload(Invoice.customer)).order_by(
+        Invoice.created_at.desc()
+    ).limit(5).all()
+    
+    low_stock_products = Product.query.filter(Product.low_stock_filter()).all()
+    
+    overdue_installments = Installment.query.options(
+        joinedload(Installment.invoice).joinedload(Invoice.customer)
+    ).filter(
         Installment.status.in_(['pending', 'partial', 'overdue']),
         Installment.due_date < today
-    ).all()
-    
-    for inst in overdue_installments:
-        if inst.status != 'overdue':
-            inst.status = 'overdue'
-            db.session.commit()
+    ).order_by(Installment.due_date, Installment.id).limit(5).all()
     
     total_customers = Customer.query.count()
     total_products = Product.query.count()
@@ -77,22 +95,35 @@ def dashboard():
                          total_products=total_products)
 
 
-@app.route('/customers')
+@bp.route('/customers')
+@replica_reads
 def customers_list():
     search = request.args.get('search', '')
     if search:
-        customers = Customer.query.filter(
-            or_(
-                Customer.name.ilike(f'%{search}%'),
-                Customer.phone.ilike(f'%{search}%')
-            )
-        ).order_by(Customer.name).all()
+        customers = KeysetPage(search_customers(search))
     else:
-        customers = Customer.query.order_by(Customer.name).all()
+        customers = paginate_keyset(Customer.query, [Customer.name, Customer.id],
+                                    after=request.args.get('after'),
+                                    before=request.args.get('before'))
     return render_template('customers/list.html', customers=customers, search=search)
 
 
-@app.route('/customers/add', methods=['GET', 'POST'])
+@bp.route('/customers/search')
+def customer_search():
+    query = request.args.get('q', '').strip()
+    # Same results until a customer is added, edited or removed.
+    cached = not_modified(*db.session.query(func.max(Customer.updated_at), func.count(Customer.id)).one())
+    if cached is not None:
+        return cached
+    customers = search_customers(query, limit=20) if query else []
+    return jsonify([{
+        'id': c.id,
+        'name': c.name,
+        'phone': c.phone
+    } for c in customers])
+
+
+@bp.route('/customers/add', methods=['GET', 'POST'])
 def customer_add():
     if request.method == 'POST':
         customer = Customer(
@@ -104,11 +135,11 @@ def customer_add():
         db.session.add(customer)
         db.session.commit()
         flash('تم إضافة العميل بنجاح', 'success')
-        return redirect(url_for('customers_list'))
+        return redirect(url_for('.customers_list'))
     return render_template('customers/form.html', customer=None)
 
 
-@app.route('/customers/<int:id>/edit', methods=['GET', 'POST'])
+@bp.route('/customers/<int:id>/edit', methods=['GET', 'POST'])
 def customer_edit(id):
     customer = Customer.query.get_or_404(id)
     if request.method == 'POST':
@@ -118,45 +149,56 @@ def customer_edit(id):
         customer.notes = request.form.get('notes', '')
         db.session.commit()
         flash('تم تحديث بيانات العميل بنجاح', 'success')
-        return redirect(url_for('customers_list'))
+        return redirect(url_for('.customers_list'))
     return render_template('customers/form.html', customer=customer)
 
 
-@app.route('/customers/<int:id>/delete', methods=['POST'])
+@bp.route('/customers/<int:id>/delete', methods=['POST'])
 def customer_delete(id):
     customer = Customer.query.get_or_404(id)
-    if customer.invoices.count() > 0:
+    if customer.invoices.count() > 0 or has_archived_invoices(customer.id):
         flash('لا يمكن حذف العميل لوجود فواتير مرتبطة به', 'error')
     else:
         db.session.delete(customer)
         db.session.commit()
         flash('تم حذف العميل بنجاح', 'success')
-    return redirect(url_for('customers_list'))
+    return redirect(url_for('.customers_list'))
 
 
-@app.route('/customers/<int:id>')
+@bp.route('/customers/<int:id>')
 def customer_view(id):
+    stamps = db.session.query(
+        Customer.updated_at,
+        db.select(func.max(Invoice.updated_at)).where(Invoice.customer_id == Customer.id).scalar_subquery(),
+        db.select(func.count(Invoice.id)).where(Invoice.customer_id == Customer.id).scalar_subquery(),
+    ).filter(Customer.id == id).first()
+    if stamps is None:
+        abort(404)
+    cached = not_modified(*stamps)
+    if cached:
+        return cached
     customer = Customer.query.get_or_404(id)
-    invoices = customer.invoices.order_by(Invoice.created_at.desc()).all()
+    invoices = customer_invoices(customer.id)
     return render_template('customers/view.html', customer=customer, invoices=invoices)
 
 
-@app.route('/products')
+@bp.route('/products')
+@replica_reads
 def products_list():
+    cached = not_modified(*db.session.query(func.max(Product.updated_at), func.count(Product.id)).one())
+    if cached:
+        return cached
     search = request.args.get('search', '')
     if search:
-        products = Product.query.filter(
-            or_(
-                Product.name.ilike(f'%{search}%'),
-                Product.barcode.ilike(f'%{search}%')
-            )
-        ).order_by(Product.name).all()
+        products = KeysetPage(search_products(search))
     else:
-        products = Product.query.order_by(Product.name).all()
+        products = paginate_keyset(Product.query, [Product.name, Product.id],
+                                   after=request.args.get('after'),
+                                   before=request.args.get('before'))
     return render_template('products/list.html', products=products, search=search)
 
 
-@app.route('/products/add', methods=['GET', 'POST'])
+@bp.route('/products/add', methods=['GET', 'POST'])
 def product_add():
     if request.method == 'POST':
         product = Product(
@@ -167,63 +209,71 @@ def product_add():
             min_stock_level=int(request.form.get('min_stock_level', 5))
         )
         db.session.add(product)
+        db.session.flush()
+        record_movements('adjustment', {product.id: product.stock_quantity})
         db.session.commit()
+        bump_catalog_version()
+        invalidate_reports()
         flash('تم إضافة المنتج بنجاح', 'success')
-        return redirect(url_for('products_list'))
+        return redirect(url_for('.products_list'))
     return render_template('products/form.html', product=None)
 
 
-@app.route('/products/<int:id>/edit', methods=['GET', 'POST'])
+@bp.route('/products/<int:id>/edit', methods=['GET', 'POST'])
 def product_edit(id):
     product = Product.query.get_or_404(id)
     if request.method == 'POST':
         product.barcode = request.form.get('barcode', '')
         product.name = request.form['name']
         product.price = Decimal(request.form['price'])
-        product.stock_quantity = int(request.form.get('stock_quantity', 0))
+        stock_quantity = int(request.form.get('stock_quantity', 0))
+        record_movements('adjustment', {product.id: stock_quantity - (product.stock_quantity or 0)})
+        product.stock_quantity = stock_quantity
         product.min_stock_level = int(request.form.get('min_stock_level', 5))
         db.session.commit()
+        bump_catalog_version()
+        invalidate_reports()
         flash('تم تحديث بيانات المنتج بنجاح', 'success')
-        return redirect(url_for('products_list'))
+        return redirect(url_for('.products_list'))
     return render_template('products/form.html', product=product)
 
 
-@app.route('/products/<int:id>/delete', methods=['POST'])
+@bp.route('/products/<int:id>/delete', methods=['POST'])
 def product_delete(id):
     product = Product.query.get_or_404(id)
+    record_movements('adjustment', {product.id: -(product.stock_quantity or 0)})
     db.session.delete(product)
     db.session.commit()
+    bump_catalog_version()
+    invalidate_reports()
     flash('تم حذف المنتج بنجاح', 'success')
-    return redirect(url_for('products_list'))
+    return redirect(url_for('.products_list'))
 
 
-@app.route('/products/search')
+@bp.route('/products/search')
 def product_search():
-    query = request.args.get('q', '')
-    if query:
-        products = Product.query.filter(
-            or_(
-                Product.name.ilike(f'%{query}%'),
-                Product.barcode.ilike(f'%{query}%')
-            )
-        ).limit(10).all()
-        return jsonify([{
-            'id': p.id,
-            'barcode': p.barcode,
-            'name': p.name,
-            'price': float(p.price),
-            'stock': p.stock_quantity
-        } for p in products])
-    return jsonify([])
-
-
-@app.route('/sales')
+    query = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    version = catalog.version
+    if request.if_none_match.contains_weak(version):
+        return '', 304
+    response = jsonify(catalog.search(query, limit=limit) if query else [])
+    response.set_etag(version)
+    response.cache_control.no_cache = True
+    return response
+
+
+@bp.route('/sales')
+@replica_reads
 def sales_list():
-    invoices = Invoice.query.order_by(Invoice.created_at.desc()).all()
+    query = Invoice.query.options(joinedload(Invoice.customer))
+    invoices = paginate_keyset(query, [Invoice.created_at, Invoice.id], descending=True,
+                               after=request.args.get('after'),
+                               before=request.args.get('before'))
     return render_template('sales/list.html', invoices=invoices)
 
 
-@app.route('/sales/new', methods=['GET', 'POST'])
+@bp.route('/sales/new', methods=['GET', 'POST'])
 def sale_new():
     if request.method == 'POST':
         customer_id = request.form['customer_id']
@@ -235,123 +285,207 @@ def sale_new():
         quantities = request.form.getlist('quantity[]')
         prices = request.form.getlist('price[]')
         
-        if not product_ids:
+        lines = [
+            (int(product_id), int(quantities[i]), Decimal(prices[i]))
+            for i, product_id in enumerate(product_ids) if product_id
+        ]
+        if not lines:
             flash('يرجى إضافة منتجات للفاتورة', 'error')
-            return redirect(url_for('sale_new'))
+            return redirect(url_for('.sale_new'))
         
-        invoice = Invoice(
-            invoice_number=generate_invoice_number(),
-            customer_id=customer_id,
-            payment_method=payment_method,
-            num_installments=num_installments if payment_method == 'installment' else 1,
-            notes=notes
-        )
-        db.session.add(invoice)
-        db.session.flush()
-        
-        total = Decimal('0')
-        for i, product_id in enumerate(product_ids):
-            if product_id:
-                product = Product.query.get(product_id)
-                qty = int(quantities[i])
-                unit_price = Decimal(prices[i])
-                item_total = unit_price * qty
-                
-                item = InvoiceItem(
-                    invoice_id=invoice.id,
-                    product_id=product_id,
-                    quantity=qty,
-                    unit_price=unit_price,
-                    total_price=item_total
-                )
-                db.session.add(item)
-                
-                product.stock_quantity -= qty
-                total += item_total
-        
-        invoice.total_amount = total
-        
-        if payment_method == 'cash':
-            invoice.paid_amount = total
-            invoice.status = 'paid'
-        else:
-            invoice.paid_amount = Decimal('0')
-            invoice.status = 'pending'
-            
-            installment_amount = total / num_installments
-            for i in range(num_installments):
-                due_date = date.today() + timedelta(days=30 * (i + 1))
-                installment = Installment(
-                    invoice_id=invoice.id,
-                    installment_number=i + 1,
-                    amount=installment_amount,
-                    due_date=due_date
-                )
-                db.session.add(installment)
+        products = {
+            p.id: p for p in Product.query.filter(Product.id.in_({line[0] for line in lines})).all()
+        }
+        invoice, errors = create_sale(customer_id, payment_method, num_installments, notes, lines, products)
+        if errors:
+            db.session.rollback()
+            for error in errors:
+                flash(error, 'error')
+            return redirect(url_for('.sale_new'))
         
         db.session.commit()
+        bump_catalog_version(structure=False)
+        invalidate_reports(invoice.created_at.date())
         flash('تم إنشاء الفاتورة بنجاح', 'success')
-        return redirect(url_for('sale_view', id=invoice.id))
-    
-    customers = Customer.query.order_by(Customer.name).all()
-    products = Product.query.filter(Product.stock_quantity > 0).order_by(Product.name).all()
+        return redirect(url_for('.sale_view', id=invoice.id))
+    
+    customers = Customer.query.order_by(Customer.name, Customer.id).limit(INITIAL_PICK_LIMIT).all()
+    products = [
+        product_dict(p.id, p.barcode, p.name, p.price, p.stock_quantity)
+        for p in Product.query.filter(Product.stock_quantity > 0)
+        .order_by(Product.name, Product.id).limit(INITIAL_PICK_LIMIT)
+    ]
     return render_template('sales/form.html', customers=customers, products=products)
 
 
-@app.route('/sales/<int:id>')
+@bp.route('/sales/<int:id>')
 def sale_view(id):
-    invoice = Invoice.query.get_or_404(id)
+    stamps = db.session.query(
+        Invoice.updated_at,
+        Customer.updated_at,
+        db.select(func.max(Installment.updated_at)).where(Installment.invoice_id == Invoice.id).scalar_subquery(),
+        db.select(func.max(Product.updated_at)).join(InvoiceItem, InvoiceItem.product_id == Product.id)
+        .where(InvoiceItem.invoice_id == Invoice.id).scalar_subquery(),
+    ).join(Customer, Invoice.customer_id == Customer.id).filter(Invoice.id == id).first()
+    if stamps is None:
+        abort(404)
+    cached = not_modified(*stamps)
+    if cached:
+        return cached
+    invoice = Invoice.query.options(
+        joinedload(Invoice.customer),
+        selectinload(Invoice.items).joinedload(InvoiceItem.product),
+        selectinload(Invoice.installments)
+    ).get_or_404(id)
     return render_template('sales/view.html', invoice=invoice)
 
 
-@app.route('/sales/<int:id>/delete', methods=['POST'])
+@bp.route('/sales/<int:id>/delete', methods=['POST'])
 def sale_delete(id):
-    invoice = Invoice.query.get_or_404(id)
-    
+    # A payment landing between reading the balance and deleting would
+    # leave the customer's debt off by that payment. Installments before
+    # the invoice, the order the payment paths lock in.
+    lock_rows(Installment, Installment.invoice_id == id)
+    lock_rows(Invoice, Invoice.id == id)
+    invoice = Invoice.query.options(
+        selectinload(Invoice.items),
+        selectinload(Invoice.installments).selectinload(Installment.payments)
+    ).get_or_404(id)
+    
+    restock = defaultdict(int)
     for item in invoice.items:
-        product = Product.query.get(item.product_id)
-        if product:
-            product.stock_quantity += item.quantity
-    
+        restock[item.product_id] += item.quantity
+    release_stock(restock)
+    record_movements('return', restock, invoice.id)
+    
+    adjust_customer_debt(invoice.customer_id, -invoice.get_remaining_balance())
+    remove_sale(invoice)
+    record_product_sales(invoice.created_at.date(),
+                         [(item.product_id, item.quantity, item.total_price) for item in invoice.items], sign=-1)
     db.session.delete(invoice)
     db.session.commit()
+    bump_catalog_version(structure=False)
+    invalidate_reports(invoice.created_at.date())
     flash('تم حذف الفاتورة بنجاح', 'success')
-    return redirect(url_for('sales_list'))
-
-
-@app.route('/installments')
+    return redirect(url_for('.sales_list'))
+
+
+def _positive_int(value):
+    return int(value) if str(value).isdigit() and int(value) > 0 else None
+
+
+def parse_sales_json(payload):
+    # {"sales": [{"key", "customer_id", "payment_method", "num_installments",
+    #   "notes", "items": [{"product_id", "quantity", "unit_price"}]}]};
+    # unit_price defaults to the catalogue price.
+    entries = []
+    for line, item in enumerate(payload.get('sales') or [], start=1):
+        if not isinstance(item, dict):
+            item = {}
+        key = str(item.get('key') or '').strip()
+        entry = SaleEntry(line, key, _positive_int(item.get('customer_id')), item.get('payment_method'),
+                          _positive_int(item.get('num_installments', 1)), item.get('notes') or '')
+        entries.append(entry)
+        if not key or len(key) > 100:
+            entry.errors.append('مفتاح العملية (key) مطلوب ولا يتجاوز 100 حرف')
+        if entry.customer_id is None:
+            entry.errors.append(f'رقم العميل غير صحيح: {item.get("customer_id")}')
+        if entry.payment_method not in ('cash', 'installment'):
+            entry.errors.append(f'طريقة الدفع غير صحيحة: {entry.payment_method}')
+        if entry.num_installments is None:
+            entry.errors.append(f'عدد الأقساط غير صحيح: {item.get("num_installments")}')
+        for sale_line in item.get('items') or []:
+            sale_line = sale_line if isinstance(sale_line, dict) else {}
+            product_id = _positive_int(sale_line.get('product_id'))
+            qty = _positive_int(sale_line.get('quantity'))
+            unit_price = sale_line.get('unit_price')
+            if unit_price is not None:
+                unit_price = parse_amount(unit_price)
+            if product_id is None or qty is None or ('unit_price' in sale_line and unit_price is None):
+                entry.errors.append(f'سطر منتج غير صحيح: {sale_line}')
+                continue
+            entry.lines.append((product_id, qty, unit_price))
+        if not entry.lines and not entry.errors:
+            entry.errors.append('لا توجد منتجات في العملية')
+        if entry.errors:
+            entry.status = 'error'
+    return entries
+
+
+@bp.route('/sales/batch', methods=['POST'])
+def sales_batch():
+    # For tills replaying their offline queue: every sale carries the
+    # till's own idempotency key, so resending a batch never duplicates.
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'يجب إرسال JSON'}), 400
+    entries = parse_sales_json(payload)
+    if len(entries) > MAX_SALE_BATCH:
+        return jsonify({'error': f'الحد الأقصى {MAX_SALE_BATCH} عملية في الطلب'}), 400
+    atomic = bool(payload.get('atomic'))
+    result = submit_sales(entries, atomic=atomic)
+    if result.count('created'):
+        bump_catalog_version(structure=False)
+        invalidate_reports(*result.days)
+    body = {
+        'created': result.count('created'),
+        'duplicates': result.count('duplicate'),
+        'failed': result.count('error'),
+        'results': [{
+            'key': entry.key,
+            'status': entry.status,
+            'invoice_id': entry.invoice_id,
+            'invoice_number': entry.invoice_number,
+            'errors': entry.errors,
+        } for entry in entries],
+    }
+    return jsonify(body), 400 if atomic and result.count('error') else 200
+
+
+@bp.route('/installments')
+@replica_reads
 def installments_list():
-    status_filter = request.args.get('status', '')
+    status = request.args.get('status', '')
     customer_filter = request.args.get('customer', '')
     
-    query = Installment.query.join(Invoice).join(Customer)
+    query = Installment.query.join(Invoice).join(Customer).options(
+        contains_eager(Installment.invoice).contains_eager(Invoice.customer)
+    )
     
-    if status_filter:
-        query = query.filter(Installment.status == status_filter)
+    if status:
+        query = query.filter(status_filter(status))
     
     if customer_filter:
         query = query.filter(Invoice.customer_id == customer_filter)
     
-    installments = query.order_by(Installment.due_date).all()
-    
-    today = date.today()
-    for inst in installments:
-        if inst.status in ['pending', 'partial'] and inst.due_date < today:
-            inst.status = 'overdue'
-            db.session.commit()
+    installments = paginate_keyset(query, [Installment.due_date, Installment.id],
+                                   after=request.args.get('after'),
+                                   before=request.args.get('before'))
     
-    customers = Customer.query.order_by(Customer.name).all()
+    # Only the selected customer; the picker searches /customers/search.
+    selected_customer = db.session.get(Customer, int(customer_filter)) if customer_filter.isdigit() else None
     
     return render_template('installments/list.html', 
                          installments=installments,
-                         customers=customers,
-                         status_filter=status_filter,
+                         selected_customer=selected_customer,
+                         status_filter=status,
                          customer_filter=customer_filter)
 
 
-@app.route('/installments/<int:id>/pay', methods=['GET', 'POST'])
+@bp.route('/installments/<int:id>/pay', methods=['GET', 'POST'])
 def installment_pay(id):
-    installment = Installment.query.get_or_404(id)
+    if request.method == 'POST':
+        # Lock the installment, then its invoice (the order collect_payments
+        # uses) before reading balances, so concurrent payments queue instead
+        # of overwriting each other.
+        lock_rows(Installment, Installment.id == id)
+        lock_rows(Invoice, Invoice.id == db.select(Installment.invoice_id).where(
+            Installment.id == id
+        ).scalar_subquery())
+    installment = Installment.query.options(
+        joinedload(Installment.invoice).joinedload(Invoice.customer),
+        selectinload(Installment.payments)
+    ).get_or_404(id)
     
     if request.method == 'POST':
         amount = Decimal(request.form['amount'])
@@ -375,68 +509,132 @@ def installment_pay(id):
         invoice.paid_amount = Decimal(str(invoice.paid_amount)) + amount
         invoice.update_status()
         
+        adjust_customer_debt(invoice.customer_id, -amount)
+        record_payment(invoice, amount)
+        
         db.session.commit()
+        invalidate_reports(invoice.created_at.date())
         flash(f'تم تسجيل دفعة بمبلغ {amount}', 'success')
-        return redirect(url_for('installments_list'))
+        return redirect(url_for('.installments_list'))
     
     return render_template('installments/pay.html', installment=installment)
 
 
-@app.route('/reports')
-def reports():
-    today = date.today()
-    month_start = today.replace(day=1)
-    year_start = today.replace(month=1, day=1)
-    
-    start_date = request.args.get('start_date', month_start.strftime('%Y-%m-%d'))
-    end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
-    
-    start = datetime.strptime(start_date, '%Y-%m-%d')
-    end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
-    
-    total_sales = db.session.query(func.sum(Invoice.total_amount)).filter(
-        Invoice.created_at >= start,
-        Invoice.created_at < end
-    ).scalar() or 0
+def parse_collection_json(payload):
+    entries, errors = [], []
+    for line, item in enumerate(payload.get('entries') or [], start=1):
+        if not isinstance(item, dict):
+            errors.append((line, 'صيغة غير صحيحة'))
+            continue
+        amount = parse_amount(item.get('amount', ''))
+        if amount is None:
+            errors.append((line, f'المبلغ غير صحيح: {item.get("amount")}'))
+            continue
+        customer_id = item.get('customer_id')
+        if customer_id is not None and not str(customer_id).isdigit():
+            errors.append((line, f'رقم العميل غير صحيح: {customer_id}'))
+            continue
+        entries.append(CollectionEntry(line, amount,
+                                       invoice_number=item.get('invoice_number'),
+                                       customer_id=int(customer_id) if customer_id is not None else None,
+                                       phone=item.get('phone'),
+                                       notes=item.get('notes') or ''))
+    return entries, errors
+
+
+@bp.route('/installments/collect', methods=['GET', 'POST'])
+def installments_collect():
+    if request.method == 'GET':
+        return render_template('installments/collect.html', result=None, errors=[], text='', notes='')
+    
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'يجب إرسال JSON'}), 400
+        entries, errors = parse_collection_json(payload)
+        notes = payload.get('notes') or ''
+    else:
+        text = request.form.get('entries', '')
+        notes = request.form.get('notes', '')
+        entries, errors = parse_collection_text(text)
+    
+    result = None
+    if not errors:
+        result = collect_payments(entries, notes)
+        errors = result.errors
+    if errors or not result.payments:
+        db.session.rollback()
+    else:
+        db.session.commit()
+        invalidate_reports(*result.days)
     
-    cash_received = db.session.query(func.sum(Invoice.paid_amount)).filter(
-        Invoice.created_at >= start,
-        Invoice.created_at < end
-    ).scalar() or 0
+    if request.is_json:
+        body = {
+            'errors': [{'line': line, 'message': message} for line, message in errors],
+            'payments': result.payments if result and not errors else 0,
+            'applied': str(result.applied) if result and not errors else '0',
+            'unallocated': [{'line': entry.line, 'amount': str(amount)}
+                            for entry, amount in result.unallocated] if result and not errors else [],
+        }
+        return jsonify(body), 400 if errors else 200
     
-    pending_amount = db.session.query(func.sum(Invoice.total_amount - Invoice.paid_amount)).filter(
-        Invoice.status != 'paid'
-    ).scalar() or 0
+    if errors:
+        flash('لم يتم تسجيل أي دفعة، يرجى تصحيح الأخطاء', 'error')
+        return render_template('installments/collect.html', result=None, errors=errors, text=text, notes=notes)
+    flash(f'تم تسجيل {result.payments} دفعة بإجمالي {result.applied}', 'success')
+    return render_template('installments/collect.html', result=result, errors=[], text='', notes='')
+
+
+def current_report_snapshot():
+    pending_amount = db.session.query(func.sum(Customer.outstanding_balance)).scalar() or 0
     
     inventory_value = db.session.query(
         func.sum(Product.price * Product.stock_quantity)
     ).scalar() or 0
     
-    invoices_count = Invoice.query.filter(
-        Invoice.created_at >= start,
-        Invoice.created_at < end
-    ).count()
-    
-    products_report = db.session.query(
-        Product.name,
-        Product.stock_quantity,
-        Product.min_stock_level,
-        Product.price
-    ).all()
-    
-    daily_sales = db.session.query(
-        func.date(Invoice.created_at).label('date'),
-        func.sum(Invoice.total_amount).label('total')
-    ).filter(
-        Invoice.created_at >= start,
-        Invoice.created_at < end
-    ).group_by(func.date(Invoice.created_at)).all()
+    products_report = [dict(name=name, stock_quantity=stock, min_stock_level=min_level, price=price)
+                       for name, stock, min_level, price in db.session.query(
+                           Product.name,
+                           Product.stock_quantity,
+                           Product.min_stock_level,
+                           Product.price
+                       )]
+    return {
+        'pending_amount': pending_amount,
+        'inventory_value': inventory_value,
+        'products_report': products_report
+    }
+
+
+@bp.route('/reports')
+@replica_reads
+def reports():
+    start_date, end_date, start, end = get_date_range()
+    
+    totals = cached_report('range_totals', lambda: {
+        'totals': tuple(range_totals(start, end)),
+        'daily_sales': [dict(date=row.date, total=row.total) for row in daily_sales_series(start, end)]
+    }, start, end)
+    total_sales, cash_received, invoices_count = totals['totals']
+    daily_sales = totals['daily_sales']
+    
+    snapshot = cached_report('snapshot', current_report_snapshot)
+    pending_amount = snapshot['pending_amount']
+    inventory_value = snapshot['inventory_value']
+    products_report = snapshot['products_report']
+    inventory_date = None
+    if end < date.today():
+        # Past periods: stock as it stood at the end of the range, from the
+        # nearest stock snapshot plus the movements since.
+        inventory_value = cached_report('inventory_value', lambda: inventory_value_at(end_of_day(end)), end, end)
+        inventory_date = end_date
     
     return render_template('reports/index.html',
                          total_sales=total_sales,
                          cash_received=cash_received,
                          pending_amount=pending_amount,
                          inventory_value=inventory_value,
+                         inventory_date=inventory_date,
                          invoices_count=invoices_count,
                          products_report=products_report,
                          daily_sales=daily_sales,
@@ -444,7 +642,124 @@ def reports():
                          end_date=end_date)
 
 
-@app.route('/seed-data')
+@bp.route('/reports/products')
+@replica_reads
+def product_analytics():
+    start_date, end_date, start, end = get_date_range()
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    quantity, revenue, products_sold = product_sales_totals(start, end)
+    return render_template('reports/products.html',
+                         by_quantity=top_products(start, end, 'quantity', limit),
+                         by_revenue=top_products(start, end, 'revenue', limit),
+                         slow=slow_movers(start, end, limit),
+                         quantity=quantity,
+                         revenue=revenue,
+                         products_sold=products_sold,
+                         velocity_days=VELOCITY_DAYS,
+                         limit=limit,
+                         start_date=start_date,
+                         end_date=end_date)
+
+
+def get_aging_customer_ids():
+    customer_filter = request.args.get('customer', type=int)
+    query = request.args.get('search', '').strip()
+    if customer_filter:
+        return [customer_filter]
+    if query:
+        return [c.id for c in search_customers(query)]
+    return None
+
+
+@bp.route('/reports/aging')
+@replica_reads
+def aging_report():
+    today = date.today()
+    query = aging_report_query(today, get_aging_customer_ids())
+    rows = paginate_keyset(query, [Customer.name, Customer.id],
+                           after=request.args.get('after'),
+                           before=request.args.get('before'))
+    return render_template('reports/aging.html',
+                         rows=rows,
+                         totals=aging_totals(rows.items),
+                         buckets=AGING_BUCKETS,
+                         today=today,
+                         search=request.args.get('search', ''),
+                         customer_filter=request.args.get('customer', ''))
+
+
+@bp.route('/export/sales.csv')
+@replica_reads
+def export_sales():
+    start_date, end_date, start, end = get_date_range()
+    return csv_response(f'sales_{start_date}_{end_date}.csv', INVOICE_HEADER, invoice_rows(start, end))
+
+
+@bp.route('/export/installments.csv')
+@replica_reads
+def export_installments():
+    filters = []
+    status = request.args.get('status', '')
+    customer_filter = request.args.get('customer', '')
+    if status:
+        filters.append(status_filter(status))
+    if customer_filter:
+        filters.append(Invoice.customer_id == customer_filter)
+    return csv_response('installments.csv', INSTALLMENT_HEADER, installment_rows(filters))
+
+
+@bp.route('/export/reports.csv')
+@replica_reads
+def export_reports():
+    start_date, end_date, start, end = get_date_range()
+    return csv_response(f'daily_sales_{start_date}_{end_date}.csv', DAILY_REPORT_HEADER,
+                        daily_report_rows(start, end))
+
+
+@bp.route('/export/aging.csv')
+@replica_reads
+def export_aging():
+    today = date.today()
+    return csv_response(f'aging_{today}.csv', AGING_HEADER, aging_rows(today, get_aging_customer_ids()))
+
+
+@bp.route('/export/stock.csv')
+@replica_reads
+def export_stock():
+    try:
+        day = datetime.strptime(request.args.get('date') or date.today().strftime('%Y-%m-%d'), '%Y-%m-%d').date()
+    except ValueError:
+        abort(400, 'التاريخ غير صحيح، الصيغة المطلوبة YYYY-MM-DD')
+    return csv_response(f'stock_{day.isoformat()}.csv', STOCK_HEADER, stock_rows(end_of_day(day)))
+
+
+IMPORTERS = {
+    'products': (import_products, 'المنتجات', 'pos.products_list', 'barcode, name, price, stock_quantity, min_stock_level'),
+    'customers': (import_customers, 'العملاء', 'pos.customers_list', 'name, phone, address, notes'),
+}
+
+
+@bp.route('/import/<kind>', methods=['GET', 'POST'])
+def import_csv(kind):
+    if kind not in IMPORTERS:
+        abort(404)
+    importer, title, back_endpoint, columns = IMPORTERS[kind]
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('يرجى اختيار ملف CSV', 'error')
+            return redirect(url_for('.import_csv', kind=kind))
+        result = importer(open_csv(upload.stream))
+        if result.imported:
+            flash(f'تم استيراد {result.imported} سطر بنجاح', 'success')
+        if result.failed:
+            flash(f'{result.failed} سطر لم يتم استيراده', 'error')
+    return render_template('imports/form.html', title=title, back_endpoint=back_endpoint,
+                           columns=columns, result=result)
+
+
+@bp.route('/seed-data')
 def seed_data():
     if Customer.query.count() == 0:
         customers = [
@@ -472,7 +787,11 @@ def seed_data():
         ]
         for p in products:
             db.session.add(p)
+        db.session.flush()
+        record_movements('adjustment', {p.id: p.stock_quantity for p in products})
     
     db.session.commit()
+    bump_catalog_version()
+    invalidate_reports()
     flash('تم إضافة البيانات التجريبية بنجاح', 'success')
-    return redirect(url_for('dashboard'))
+    return redirect(url_for('.dashboard'))
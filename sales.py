@@ -0,0 +1,192 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from sqlalchemy.exc import IntegrityError
+from app import db
+from debts import adjust_customer_debt
+from inventory import record_movements
+from models import Customer, Installment, Invoice, InvoiceItem, Product, SaleRequest
+from numbering import next_invoice_number
+from rollups import record_product_sales, record_sale
+from stock import reserve_stock
+
+
+def create_sale(customer_id, payment_method, num_installments, notes, lines, products):
+    # `lines` are (product_id, quantity, unit_price); `products` maps product
+    # id to anything with name and stock_quantity. Writes in the caller's
+    # transaction and returns (invoice, errors); on errors the caller must
+    # roll back, stock may already be reserved.
+    requested = defaultdict(int)
+    for product_id, qty, unit_price in lines:
+        requested[product_id] += qty
+
+    errors = [f'المنتج رقم {product_id} غير موجود' for product_id in requested if product_id not in products]
+    if not errors:
+        for product_id in reserve_stock(requested):
+            product = products[product_id]
+            errors.append(
+                f'الكمية المطلوبة من "{product.name}" ({requested[product_id]}) '
+                f'أكبر من المتوفر ({product.stock_quantity})'
+            )
+    if errors:
+        return None, errors
+
+    invoice = Invoice(
+        invoice_number=next_invoice_number(),
+        customer_id=customer_id,
+        payment_method=payment_method,
+        num_installments=num_installments if payment_method == 'installment' else 1,
+        notes=notes
+    )
+    db.session.add(invoice)
+    db.session.flush()
+
+    items = [{
+        'invoice_id': invoice.id,
+        'product_id': product_id,
+        'quantity': qty,
+        'unit_price': unit_price,
+        'total_price': unit_price * qty
+    } for product_id, qty, unit_price in lines]
+    db.session.execute(db.insert(InvoiceItem), items)
+    record_movements('sale', {product_id: -qty for product_id, qty in requested.items()}, invoice.id)
+    total = sum((item['total_price'] for item in items), Decimal('0'))
+
+    invoice.total_amount = total
+
+    if payment_method == 'cash':
+        invoice.paid_amount = total
+        invoice.status = 'paid'
+    else:
+        invoice.paid_amount = Decimal('0')
+        invoice.status = 'pending'
+
+        installment_amount = total / num_installments
+        db.session.execute(db.insert(Installment), [{
+            'invoice_id': invoice.id,
+            'installment_number': i + 1,
+            'amount': installment_amount,
+            'due_date': date.today() + timedelta(days=30 * (i + 1))
+        } for i in range(num_installments)])
+
+    adjust_customer_debt(invoice.customer_id, invoice.get_remaining_balance())
+    record_sale(invoice)
+    record_product_sales(invoice.created_at.date(),
+                         [(item['product_id'], item['quantity'], item['total_price']) for item in items])
+    return invoice, []
+
+
+class SaleEntry:
+    # One queued sale from a till. `key` is the till's idempotency key; a
+    # replayed key reports the invoice created the first time.
+    def __init__(self, line, key, customer_id, payment_method, num_installments=1, notes='', lines=()):
+        self.line = line
+        self.key = key
+        self.customer_id = customer_id
+        self.payment_method = payment_method
+        self.num_installments = num_installments
+        self.notes = notes
+        self.lines = list(lines)
+        self.status = 'pending'  # created, duplicate, error, rolled_back
+        self.errors = []
+        self.invoice_id = None
+        self.invoice_number = None
+        self.created_at = None
+
+
+class SaleBatchResult:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def count(self, status):
+        return sum(1 for entry in self.entries if entry.status == status)
+
+    @property
+    def days(self):
+        return sorted({entry.created_at.date() for entry in self.entries if entry.status == 'created'})
+
+
+def _mark_applied(entries, rows):
+    for entry in entries:
+        row = rows.get(entry.key)
+        if row is not None:
+            entry.status = 'duplicate'
+            entry.invoice_id, entry.invoice_number = row
+
+
+def _applied_keys(keys):
+    return {key: (invoice_id, number) for key, invoice_id, number in db.session.query(
+        SaleRequest.key, SaleRequest.invoice_id, SaleRequest.invoice_number
+    ).filter(SaleRequest.key.in_(keys))} if keys else {}
+
+
+def submit_sales(entries, atomic=False):
+    # Replayed keys cost one lookup and no writes. Products and customers
+    # for the rest are fetched once for the whole batch. Each sale commits
+    # on its own, so one short product doesn't hold back the queue; with
+    # atomic=True the batch is one transaction and the first failure rolls
+    # everything back.
+    result = SaleBatchResult(entries)
+    seen = set()
+    for entry in entries:
+        if entry.key and entry.key in seen:
+            entry.status = 'error'
+            entry.errors.append(f'مفتاح العملية مكرر في نفس الدفعة: {entry.key}')
+        seen.add(entry.key)
+    _mark_applied(entries, _applied_keys(seen))
+    pending = [entry for entry in entries if entry.status == 'pending']
+    if not pending:
+        return result
+
+    product_ids = {product_id for entry in pending for product_id, _, _ in entry.lines}
+    products = {row.id: row for row in db.session.query(
+        Product.id, Product.name, Product.price, Product.stock_quantity
+    ).filter(Product.id.in_(product_ids))}
+    customer_ids = {entry.customer_id for entry in pending}
+    customers = {row[0] for row in db.session.query(Customer.id).filter(Customer.id.in_(customer_ids))}
+
+    failed = atomic and result.count('error') > 0
+    for entry in pending:
+        if failed:
+            break
+        invoice = None
+        if entry.customer_id not in customers:
+            entry.errors.append(f'العميل غير موجود: {entry.customer_id}')
+        else:
+            lines = [(product_id, qty, products[product_id].price if unit_price is None and product_id in products
+                      else unit_price) for product_id, qty, unit_price in entry.lines]
+            invoice, entry.errors = create_sale(entry.customer_id, entry.payment_method,
+                                                entry.num_installments, entry.notes, lines, products)
+        if invoice is not None:
+            try:
+                # Claims the key; a concurrent replay of the same key waits
+                # on this row and then fails here.
+                db.session.execute(db.insert(SaleRequest).values(
+                    key=entry.key, invoice_id=invoice.id, invoice_number=invoice.invoice_number,
+                    created_at=datetime.utcnow()
+                ))
+            except IntegrityError:
+                db.session.rollback()
+                _mark_applied([entry], _applied_keys([entry.key]))
+                failed = atomic
+                continue
+        if invoice is None:
+            db.session.rollback()
+            entry.status = 'error'
+            failed = atomic
+            continue
+        entry.status = 'created'
+        entry.invoice_id, entry.invoice_number, entry.created_at = invoice.id, invoice.invoice_number, invoice.created_at
+        if not atomic:
+            db.session.commit()
+
+    if atomic:
+        if failed:
+            db.session.rollback()
+            for entry in entries:
+                if entry.status in ('created', 'pending'):
+                    entry.status = 'rolled_back'
+                    entry.invoice_id = entry.invoice_number = entry.created_at = None
+        else:
+            db.session.commit()
+    return result
@@ -0,0 +1,160 @@
+import re
+from sqlalchemy import event, func, text
+from sqlalchemy.exc import DatabaseError
+from app import db
+from models import Customer, Product
+
+SEARCH_LIMIT = 100
+
+_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]')
+_FOLDS = str.maketrans({
+    '\u0623': '\u0627', '\u0625': '\u0627', '\u0622': '\u0627', '\u0671': '\u0627',  # أ إ آ ٱ -> ا
+    '\u0649': '\u064a', '\u0626': '\u064a',  # ى ئ -> ي
+    '\u0624': '\u0648',  # ؤ -> و
+    '\u0629': '\u0647',  # ة -> ه
+})
+_SPACES = re.compile(r'\s+')
+
+_FTS_TABLES = {
+    Customer: 'customers_fts',
+    Product: 'products_fts',
+}
+
+
+def normalize_search_text(value):
+    # Fold the Arabic letter variants people type interchangeably and drop
+    # harakat/tatweel so "مُحمّد" and "محمد", "فاطمة" and "فاطمه" match.
+    value = _DIACRITICS.sub('', value or '')
+    value = value.translate(_FOLDS).lower()
+    return _SPACES.sub(' ', value).strip()
+
+
+def _search_source(target):
+    if isinstance(target, Product):
+        return f'{target.name} {target.barcode or ""}'
+    return f'{target.name} {target.phone or ""}'
+
+
+@event.listens_for(Customer, 'before_insert')
+@event.listens_for(Customer, 'before_update')
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+def _set_search_text(mapper, connection, target):
+    target.search_text = normalize_search_text(_search_source(target))
+
+
+@event.listens_for(db.metadata, 'before_create')
+def _create_extensions(target, connection, **kw):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_fts_tables(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for model, fts in _FTS_TABLES.items():
+        table = model.__tablename__
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"search_text, content='{table}', content_rowid='id', tokenize='trigram')"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+        ))
+        connection.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF search_text ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+            f"INSERT INTO {fts}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        ))
+
+
+def _fts_check(connection, fts):
+    # rank=1 also compares the index with the rows of the content table.
+    try:
+        connection.execute(text(f"INSERT INTO {fts}({fts}, rank) VALUES ('integrity-check', 1)"))
+    except DatabaseError:
+        return False
+    return True
+
+
+def sync_search_index(connection, existing):
+    # External-content FTS tables start empty even when created next to rows
+    # that already exist, and the update trigger's 'delete' of a row that was
+    # never indexed leaves FTS5 reporting a malformed database. Index new
+    # tables over existing rows, and rebuild any index out of step with them.
+    if connection.dialect.name != 'sqlite':
+        return []
+    actions = []
+    for model, fts in _FTS_TABLES.items():
+        if fts not in existing:
+            if model.__tablename__ not in existing:
+                continue
+            action = f'indexed existing rows in {fts}'
+        elif _fts_check(connection, fts):
+            continue
+        else:
+            action = f'rebuilt out-of-date index {fts}'
+        connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        actions.append(action)
+    return actions
+
+
+def _search(model, query, limit):
+    term = normalize_search_text(query)
+    if not term:
+        return []
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'sqlite' and len(term) >= 3:
+        fts = _FTS_TABLES[model]
+        ids = db.session.execute(
+            text(f'SELECT rowid FROM {fts} WHERE {fts} MATCH :term ORDER BY rank LIMIT :limit'),
+            {'term': '"' + term.replace('"', '""') + '"', 'limit': limit}
+        ).scalars().all()
+        rows = {row.id: row for row in model.query.filter(model.id.in_(ids)).all()}
+        return [rows[i] for i in ids if i in rows]
+
+    matches = model.query.filter(model.search_text.contains(term, autoescape=True))
+    if dialect == 'postgresql':
+        # LIKE '%term%' is served by the gin_trgm_ops index
+        matches = matches.order_by(func.similarity(model.search_text, term).desc(), model.id)
+    else:
+        matches = matches.order_by(func.length(model.search_text), model.id)
+    return matches.limit(limit).all()
+
+
+def search_customers(query, limit=SEARCH_LIMIT):
+    return _search(Customer, query, limit)
+
+
+def search_products(query, limit=SEARCH_LIMIT):
+    return _search(Product, query, limit)
+
+
+def rebuild_search_index(batch_size=1000):
+    count = 0
+    for model, fts in _FTS_TABLES.items():
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # Bring the index in line with the current rows first, so the
+            # update trigger below only ever deletes entries that exist.
+            db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+            db.session.commit()
+        last_id = 0
+        while True:
+            batch = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+            if not batch:
+                break
+            db.session.execute(db.update(model), [
+                {'id': row.id, 'search_text': normalize_search_text(_search_source(row))}
+                for row in batch
+            ])
+            db.session.commit()
+            last_id = batch[-1].id
+            count += len(batch)
+    return count
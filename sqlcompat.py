@@ -0,0 +1,27 @@
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+
+
+def dialect_insert(model):
+    # INSERT that supports on_conflict_do_update/do_nothing on both backends.
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    raise NotImplementedError(f'upsert is not supported on {dialect}')
+
+
+def lock_rows(model, *criteria):
+    # Row locks to take before reading values that will be written back.
+    # SQLite has no SELECT ... FOR UPDATE; a no-op UPDATE takes its database
+    # write lock instead, so concurrent writers queue the same way. Setting
+    # updated_at to itself keeps its onupdate from firing, so the lock
+    # doesn't change ETags or Last-Modified.
+    if db.session.get_bind().dialect.name == 'sqlite':
+        values = {'id': model.id}
+        if 'updated_at' in model.__table__.c:
+            values['updated_at'] = model.updated_at
+        db.session.execute(db.update(model).where(*criteria).values(**values))
+    else:
+        db.session.execute(db.select(model.id).where(*criteria).with_for_update())
@@ -0,0 +1,27 @@
+from app import db
+from models import Product
+
+
+def reserve_stock(quantities):
+    # Lock rows in id order so concurrent checkouts cannot deadlock; the
+    # guarded UPDATE makes the check-and-decrement a single atomic step.
+    short = []
+    for product_id in sorted(quantities):
+        qty = quantities[product_id]
+        result = db.session.execute(
+            db.update(Product)
+            .where(Product.id == product_id, Product.stock_quantity >= qty)
+            .values(stock_quantity=Product.stock_quantity - qty)
+        )
+        if result.rowcount == 0:
+            short.append(product_id)
+    return short
+
+
+def release_stock(quantities):
+    for product_id in sorted(quantities):
+        db.session.execute(
+            db.update(Product)
+            .where(Product.id == product_id)
+            .values(stock_quantity=Product.stock_quantity + quantities[product_id])
+        )